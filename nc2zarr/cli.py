@@ -206,9 +206,9 @@ def nc2zarr_batch(
     import datetime
     import time
     import os.path
-    import yaml
 
     from nc2zarr.batch import TemplateBatch
+    from nc2zarr.config import load_yaml
 
     if not os.path.isfile(config_template_path):
         raise click.exceptions.FileError(config_template_path, 'not found')
@@ -226,7 +226,7 @@ def nc2zarr_batch(
         if not os.path.isfile(scheduler_config_path):
             raise click.exceptions.FileError(scheduler_config_path, 'not found')
         with open(scheduler_config_path) as fp:
-            job_config = yaml.load(fp, Loader=yaml.SafeLoader)
+            job_config = load_yaml(fp)
 
     job_type = job_config.pop('type', 'local')
     job_env_vars = job_config.pop('env_vars', {})
@@ -19,10 +19,16 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
-from typing import Sequence, Union, Any, Dict, List
+from typing import Sequence, Union, Any, Dict, List, TextIO
 
 import yaml
 
+try:
+    # Use the LibYAML-based loader, if available, it is way faster
+    from yaml import CSafeLoader as _YamlSafeLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlSafeLoader
+
 from .error import ConverterError
 from .log import LOGGER
 
@@ -89,10 +95,21 @@ def config_to_kwargs(config: Dict[str, Any]) -> Dict[str, Any]:
                 **config)
 
 
+def load_yaml(stream: Union[str, TextIO]) -> Any:
+    """
+    Safely load YAML from *stream*, using the LibYAML-based
+    loader, if available.
+
+    :param stream: YAML text or text stream
+    :return: the loaded object
+    """
+    return yaml.load(stream, Loader=_YamlSafeLoader)
+
+
 def _load_config(path: str) -> Dict[str, Any]:
     try:
         with open(path) as fp:
-            config = yaml.load(fp, Loader=yaml.SafeLoader)
+            config = load_yaml(fp.read())
             LOGGER.info(f'Configuration {path} loaded.')
         return config
     except FileNotFoundError as e:
@@ -102,21 +119,22 @@ def _load_config(path: str) -> Dict[str, Any]:
 def _merge_configs(configs: List[Dict[str, Any]]) -> Dict[str, Any]:
     effective_config = dict()
     for config in configs:
-        effective_config = _merge_2_configs(effective_config, config)
+        _merge_config_into(effective_config, config)
     return effective_config
 
 
-def _merge_2_configs(config_1: Dict[str, Any], config_2: Dict[str, Any]) -> Dict[str, Any]:
-    effective_config = dict(config_1)
-    for k, v2 in config_2.items():
-        if k in effective_config:
-            v1 = config_1[k]
-            if isinstance(v1, dict) and isinstance(v2, dict):
-                effective_config[k] = _merge_2_configs(v1, v2)
-            elif isinstance(v1, list) and isinstance(v2, list):
-                effective_config[k] = v1 + v2
-            else:
-                effective_config[k] = v2
+def _merge_config_into(effective_config: Dict[str, Any],
+                       config: Dict[str, Any]):
+    # Merges config into effective_config in place, visiting
+    # each key of config once. Dicts of config are merged
+    # into fresh dicts so that config itself is never modified.
+    for k, v2 in config.items():
+        v1 = effective_config.get(k)
+        if isinstance(v2, dict):
+            if not isinstance(v1, dict):
+                v1 = effective_config[k] = dict()
+            _merge_config_into(v1, v2)
+        elif isinstance(v1, list) and isinstance(v2, list):
+            effective_config[k] = v1 + v2
         else:
             effective_config[k] = v2
-    return effective_config
@@ -19,6 +19,20 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+# Opening netCDF/HDF5 files concurrently with other reads is not
+# thread-safe for all backends, so prefetching is opt-in.
+DEFAULT_INPUT_PREFETCH_DEPTH = 0
 DEFAULT_OUTPUT_PATH = 'out.zarr'
 DEFAULT_OUTPUT_APPEND_DIM_NAME = 'time'
 DEFAULT_OUTPUT_RETRY_KWARGS = dict(tries=1, delay=0.1, backoff=1.1)
+DEFAULT_OUTPUT_S3_KWARGS = dict(
+    default_block_size=32 * 1024 * 1024,
+    default_cache_type='readahead',
+    config_kwargs=dict(
+        max_pool_connections=32,
+        retries=dict(max_attempts=10, mode='adaptive')
+    )
+)
+# Writing to object storage is I/O-bound, so we use more Dask
+# worker threads than there are CPU cores.
+DEFAULT_OUTPUT_S3_NUM_WORKERS = 16
@@ -18,9 +18,13 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
+import concurrent.futures
 import warnings
-from typing import Sequence, Union, Any, Dict, List
+from typing import Sequence, Union, Any, Dict, List, Optional
 
+import xarray as xr
+
+from .constants import DEFAULT_INPUT_PREFETCH_DEPTH
 from .constants import DEFAULT_OUTPUT_APPEND_DIM_NAME
 from .constants import DEFAULT_OUTPUT_PATH
 from .error import ConverterError
@@ -47,10 +51,26 @@ class Converter:
     :param input_engine:
     :param input_decode_cf:
     :param input_datetime_format:
+    :param input_chunks: mapping from dimension names to chunk sizes
+           used to open input files.
     :param input_prefetch_chunks:
+    :param input_prefetch_depth: number of subsequent input files opened
+           in the background while an input is being processed and
+           written. If 0, inputs are opened, processed, and written
+           one after the other.
+    :param input_parallel: open and preprocess input files in parallel
+           using Dask, if input_multi_file is true.
+    :param input_chunk_cache_size: size in bytes of the netCDF chunk
+           cache used for each variable of an input file opened
+           with the "netcdf4" engine. Not applied if input_parallel
+           is true and inputs are opened in worker processes.
     :param process_rename:
     :param process_custom_processor:
     :param process_rechunk:
+    :param process_rechunk_max_mem: if given, the output is created
+           using the "rechunker" package, which rechunks via an
+           intermediate store using at most the given amount of memory
+           per worker, e.g. "2GB".
     :param output_path:
     :param output_encoding:
     :param output_consolidated:
@@ -65,6 +85,11 @@ class Converter:
     :param output_adjust_metadata:
     :param output_metadata:
     :param output_s3:
+    :param output_num_workers: number of Dask worker threads used
+           to write the output. Defaults to at least 16 for object
+           storage outputs and to Dask's default otherwise.
+           Also limits the number of threads used to insert or
+           replace slices.
     :param output_custom_postprocessor:
     :param finalize_only:
     :param dry_run:
@@ -81,10 +106,15 @@ class Converter:
                  input_engine: str = None,
                  input_decode_cf: bool = False,
                  input_datetime_format: str = None,
+                 input_chunks: Dict[str, int] = None,
                  input_prefetch_chunks: bool = False,
+                 input_prefetch_depth: int = None,
+                 input_parallel: bool = False,
+                 input_chunk_cache_size: int = None,
                  process_rename: Dict[str, str] = None,
                  process_custom_processor: str = None,
                  process_rechunk: Dict[str, Dict[str, int]] = None,
+                 process_rechunk_max_mem: str = None,
                  output_path: str = None,
                  output_encoding: Dict[str, Dict[str, Any]] = None,
                  output_consolidated: bool = False,
@@ -96,6 +126,7 @@ class Converter:
                  output_metadata: Dict[str, Any] = None,
                  output_s3: Dict[str, Any] = None,
                  output_retry: Dict[str, Any] = None,
+                 output_num_workers: int = None,
                  output_custom_postprocessor: str = False,
                  finalize_only: bool = False,
                  dry_run: bool = False,
@@ -133,10 +164,17 @@ class Converter:
         self.input_engine = input_engine
         self.input_decode_cf = input_decode_cf
         self.input_datetime_format = input_datetime_format
+        self.input_chunks = input_chunks
         self.input_prefetch_chunks = input_prefetch_chunks
+        self.input_prefetch_depth = input_prefetch_depth \
+            if input_prefetch_depth is not None \
+            else DEFAULT_INPUT_PREFETCH_DEPTH
+        self.input_parallel = input_parallel
+        self.input_chunk_cache_size = input_chunk_cache_size
         self.process_rename = process_rename
         self.process_custom_processor = process_custom_processor
         self.process_rechunk = process_rechunk
+        self.process_rechunk_max_mem = process_rechunk_max_mem
         self.output_path = output_path
         self.output_custom_postprocessor = output_custom_postprocessor
         self.output_encoding = output_encoding
@@ -154,6 +192,7 @@ class Converter:
         self.output_metadata = output_metadata
         self.output_s3 = output_s3
         self.output_retry = output_retry
+        self.output_num_workers = output_num_workers
         self.finalize_only = finalize_only
         self.dry_run = dry_run
         self.verbosity = verbosity
@@ -175,10 +214,15 @@ class Converter:
         opener = DatasetOpener(input_paths=input_paths,
                                input_multi_file=self.input_multi_file,
                                input_sort_by=self.input_sort_by,
+                               input_variables=self.input_variables,
                                input_decode_cf=self.input_decode_cf,
                                input_concat_dim=self.input_concat_dim,
                                input_engine=self.input_engine,
-                               input_prefetch_chunks=self.input_prefetch_chunks)
+                               input_chunks=self.input_chunks,
+                               input_prefetch_chunks=self.input_prefetch_chunks,
+                               input_prefetch_depth=self.input_prefetch_depth,
+                               input_parallel=self.input_parallel,
+                               input_chunk_cache_size=self.input_chunk_cache_size)
 
         pre_processor = DatasetPreProcessor(input_variables=self.input_variables,
                                             input_custom_preprocessor=self.input_custom_preprocessor,
@@ -188,6 +232,7 @@ class Converter:
         processor = DatasetProcessor(process_rechunk=self.process_rechunk,
                                      process_custom_processor=self.process_custom_processor,
                                      process_rename=self.process_rename,
+                                     process_rechunk_max_mem=self.process_rechunk_max_mem,
                                      output_encoding=self.output_encoding)
 
         writer = DatasetWriter(output_path=self.output_path,
@@ -202,19 +247,66 @@ class Converter:
                                output_metadata=self.output_metadata,
                                output_s3_kwargs=self.output_s3,
                                output_retry_kwargs=self.output_retry,
+                               output_num_workers=self.output_num_workers,
+                               process_rechunk_max_mem=self.process_rechunk_max_mem,
                                input_decode_cf=self.input_decode_cf,
                                input_paths=input_paths,
                                finalize_only=self.finalize_only,
+                               defer_consolidation=True,
                                dry_run=self.dry_run)
 
         if not self.finalize_only:
-            append = None
-            for input_dataset in opener.open_datasets(preprocess=pre_processor.preprocess_dataset):
-                output_dataset, output_encoding = processor.process_dataset(input_dataset)
-                writer.write_dataset(output_dataset, encoding=output_encoding, append=append)
-                input_dataset.close()
-                append = True
+            # If prefetching is enabled, writing dataset i is done in a
+            # background thread, so it overlaps with opening and processing
+            # dataset i + 1. There is never more than one pending write,
+            # hence datasets are still written/appended in order.
+            # Otherwise, writes are awaited immediately, because
+            # opening inputs concurrently with reading data from other
+            # inputs is not safe for all backends, e.g. "netcdf4".
+            overlap_writes = self.input_prefetch_depth > 0
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                append = None
+                write_future = None
+                for input_dataset in opener.open_datasets(preprocess=pre_processor.preprocess_dataset):
+                    try:
+                        # Encodings are used only when the output is created,
+                        # so there is no need to compute them when appending.
+                        output_dataset, output_encoding = processor.process_dataset(
+                            input_dataset, with_encoding=not append
+                        )
+                        if write_future is not None:
+                            write_future.result()
+                        write_future = executor.submit(self._write_dataset,
+                                                       writer,
+                                                       input_dataset,
+                                                       output_dataset,
+                                                       output_encoding,
+                                                       append)
+                    except BaseException:
+                        # Once submitted, the write closes the input dataset
+                        input_dataset.close()
+                        raise
+                    if not overlap_writes:
+                        write_future.result()
+                        write_future = None
+                    append = True
+                if write_future is not None:
+                    write_future.result()
         else:
             LOGGER.warning('Running finalizer tasks only, no input data is being consumed.')
 
         writer.finalize_dataset()
+
+    @classmethod
+    def _write_dataset(cls,
+                       writer: DatasetWriter,
+                       input_dataset: xr.Dataset,
+                       output_dataset: xr.Dataset,
+                       output_encoding: Dict[str, Dict[str, Any]],
+                       append: Optional[bool]):
+        try:
+            writer.write_dataset(output_dataset,
+                                 encoding=output_encoding,
+                                 append=append)
+        finally:
+            input_dataset.close()
@@ -19,17 +19,27 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import functools
 import importlib
 import importlib.util
 from typing import Callable
 
 
 def load_custom_func(func_ref: str) -> Callable:
+    if not isinstance(func_ref, str):
+        raise ValueError(f'func_ref "{func_ref}" is invalid,'
+                         f' format must be <module>:<function>')
+    return _load_custom_func(func_ref)
+
+
+# Function references are resolved once only, e.g. if many
+# converters are instantiated with the same configuration
+@functools.lru_cache(maxsize=None)
+def _load_custom_func(func_ref: str) -> Callable:
     module_name, func_name = '', ''
-    if isinstance(func_ref, str):
-        func_ref_parts = func_ref.rsplit(':', maxsplit=1)
-        if len(func_ref_parts) == 2:
-            module_name, func_name = func_ref_parts
+    func_ref_parts = func_ref.rsplit(':', maxsplit=1)
+    if len(func_ref_parts) == 2:
+        module_name, func_name = func_ref_parts
     if not module_name or not func_name:
         raise ValueError(f'func_ref "{func_ref}" is invalid,'
                          f' format must be <module>:<function>')
@@ -19,25 +19,264 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
-import tempfile
+import concurrent.futures
+import os
 from collections.abc import MutableMapping
-from typing import Dict, Union, Tuple
+from typing import Any, Callable, Dict, Optional, Union, Tuple
 
+import dask
 import numpy as np
 import xarray as xr
 import zarr
+from xarray.conventions import decode_cf_variable
+from xarray.conventions import encode_cf_variable
 from zarr.errors import GroupNotFoundError
 from zarr.errors import PathNotFoundError
 
 
-# TODO: Following the general nc2zarr software design, the functions in
-#  dataslice module should instead be combined in a class DataSliceAppender
-#  that implements the various append modes using the strategy OO pattern.
-#  (See https://github.com/bcdev/nc2zarr/pull/44 )
-
 DEFAULT_EPSILON = np.array(1000 * 1000, dtype='timedelta64[ns]')
 
 
+class DataSliceAppender:
+    """
+    Appends, inserts, or replaces data slices along a dimension
+    of an existing Zarr dataset.
+
+    Other than the module's functions, an instance keeps the opened Zarr
+    arrays and the values of the dimension across successive slices, so
+    that the store's metadata is not read again for every slice.
+    Consolidated metadata is neither read nor updated, so the caller
+    must remove it before and consolidate it again, once all slices
+    have been written.
+
+    :param store: A Zarr store.
+    :param dimension: name of the dimension perpendicular to the slices
+    :param epsilon: epsilon for equality comparison. Must have the same type
+                    as the dimension variable. Defaults to 1 millisecond
+                    represented as a np.timedelta64.
+    :param num_workers: maximum number of threads used to encode
+                        and write the arrays of a slice. Defaults to
+                        the number of CPUs.
+    """
+
+    def __init__(self,
+                 store: Union[str, MutableMapping],
+                 dimension: str = "time",
+                 epsilon=DEFAULT_EPSILON,
+                 num_workers: int = None):
+        self._store = store
+        self._num_workers = num_workers or os.cpu_count() or 1
+        self._dimension = dimension
+        self._epsilon = epsilon
+        # Values of dimension, loaded on demand
+        self._values: Optional[np.ndarray] = None
+        # Last value of dimension, used if values are not loaded
+        self._last_value = None
+        self._exists = False
+        self._append_dim_arrays: Optional[Dict[str, zarr.Array]] = None
+
+    def find(self, target_value) -> Tuple[int, str]:
+        """
+        Find index and update mode for *target_value*.
+
+        :param target_value: the position along the dimension at which
+                             to insert or replace a new data slice. Must have
+                             the same type as the dimension variable.
+        :return: A tuple (insert_index, 'insert') or (insert_index, 'replace')
+                 if an index was found, (-1, 'create') or (-1, 'append')
+                 otherwise.
+        """
+        # target_value may also be a single-element array, e.g. a data
+        # slice's coordinate variable
+        target_value = np.asarray(target_value).reshape(-1)[0]
+
+        if self._values is None:
+            if not self._exists:
+                # Probing a single key is cheaper than failing to open
+                self._exists = zarr.storage.contains_group(
+                    zarr.storage.normalize_store_arg(self._store)
+                )
+                if not self._exists:
+                    return -1, 'create'
+            # Fast path for the most common case, appending beyond the
+            # last value: read the last value only, not all of them.
+            if self._last_value is None:
+                self._last_value = _get_last_value(self._store,
+                                                   self._dimension)
+            if self._last_value is not None \
+                    and target_value - self._last_value >= self._epsilon:
+                return -1, 'append'
+            try:
+                cube = xr.open_dataset(self._store, engine="zarr",
+                                       consolidated=False)
+            except (GroupNotFoundError, PathNotFoundError,
+                    FileNotFoundError):
+                # zarr directory does not exist
+                return -1, 'create'
+            with cube:
+                # Load the coordinate once rather than indexing it per step
+                self._values = cube[self._dimension].values
+
+        values = self._values
+        # Values are sorted, so bisect to find the first value
+        # that is not less than target_value
+        index = int(np.searchsorted(values, target_value, side='left'))
+        if index > 0 \
+                and abs(target_value - values[index - 1]) < self._epsilon:
+            return index - 1, 'replace'
+        if index < values.size:
+            if abs(target_value - values[index]) < self._epsilon:
+                return index, 'replace'
+            return index, 'insert'
+
+        return -1, 'append'
+
+    def get_append_run_length(self, values: np.ndarray) -> int:
+        """
+        Get the number of leading *values* that increase by at least
+        epsilon. If the first value can be appended, slices with these
+        values can be appended at once.
+
+        Appended slices are loaded into memory, so the number is limited
+        to the smallest chunk size of the arrays along the dimension.
+
+        :param values: values of the dimension, at least one
+        :return: the number of leading increasing values
+        """
+        not_increasing = np.flatnonzero(~(np.diff(values) >= self._epsilon))
+        run_length = int(not_increasing[0]) + 1 if not_increasing.size \
+            else len(values)
+        return min([run_length]
+                   + [var_array.chunks[0]
+                      for var_array in self._get_append_dim_arrays().values()])
+
+    def append(self, dataslice: xr.Dataset) -> None:
+        """
+        Append data slice, which may have more than one step
+        along the dimension.
+
+        :param dataslice: Data slice to append
+        """
+        append_dim_arrays = self._get_append_dim_arrays()
+        slice_var_names = {var_name
+                           for var_name, var in dataslice.variables.items()
+                           if self._dimension in var.dims}
+        if slice_var_names == append_dim_arrays.keys():
+            # Fast path: append encoded data to the arrays directly, which
+            # neither reads nor rewrites any other metadata
+            encoded = self._encode_arrays(append_dim_arrays, dataslice)
+
+            def append_array(var_name: str, var_array: zarr.Array):
+                var_array.append(encoded[var_name], axis=0)
+
+            _for_each_array(append_array, append_dim_arrays,
+                            self._num_workers)
+        else:
+            # Let xarray deal with variables that are new or missing
+            append_slice(self._store, dataslice,
+                         dimension=self._dimension, consolidate=False)
+            # Arrays have been resized by xarray, so our handles are outdated
+            self._append_dim_arrays = None
+        new_values = dataslice[self._dimension].values
+        if self._values is not None:
+            self._values = np.concatenate([self._values, new_values])
+        else:
+            self._last_value = new_values[-1]
+
+    def update(self,
+               insert_index: int,
+               dataslice: xr.Dataset,
+               mode: str) -> None:
+        """
+        Insert data slice or replace existing one by data slice.
+
+        :param insert_index: index at which to insert
+        :param dataslice: slice to insert
+        :param mode: Update mode, 'insert' or 'replace'
+        """
+        if mode not in ('insert', 'replace'):
+            raise ValueError(f'illegal mode value: {mode!r}')
+
+        insert_mode = mode == 'insert'
+        append_dim_arrays = self._get_append_dim_arrays()
+        encoded = self._encode_arrays(append_dim_arrays, dataslice)
+
+        def update_array(var_name: str, var_array: zarr.Array):
+            slice_array = encoded[var_name]
+            if insert_mode:
+                # Add one step, which is overwritten by the shift below,
+                # so there is no need to write empty data into it
+                var_array.resize((var_array.shape[0] + 1,)
+                                 + var_array.shape[1:])
+                # Shift contents
+                _shift_tail(var_array, insert_index)
+            # Replace slice
+            var_array[insert_index, ...] = slice_array[0]
+
+        _for_each_array(update_array, append_dim_arrays, self._num_workers)
+
+        new_value = dataslice[self._dimension].values[0]
+        if self._values is not None:
+            if insert_mode:
+                self._values = np.insert(self._values, insert_index,
+                                         new_value)
+            else:
+                self._values[insert_index] = new_value
+        else:
+            self._last_value = None
+
+    def _encode_arrays(self,
+                       arrays: Dict[str, zarr.Array],
+                       dataslice: xr.Dataset) -> Dict[str, np.ndarray]:
+        # All arrays are encoded before any of them is modified, so that
+        # a slice that cannot be encoded, e.g. because it lacks one of
+        # the variables, leaves the store unchanged.
+        encoded_vars = {var_name: self._encode(var_name, var_array, dataslice)
+                        for var_name, var_array in arrays.items()}
+        # Compute Dask-backed variables at once in a single, bounded
+        # thread pool, rather than in nested pools per variable.
+        values = dask.compute(*(var.data for var in encoded_vars.values()),
+                              scheduler='threads',
+                              num_workers=self._num_workers)
+        return {var_name: np.asarray(var_values)
+                for var_name, var_values in zip(encoded_vars, values)}
+
+    @classmethod
+    def _encode(cls,
+                var_name: str,
+                var_array: zarr.Array,
+                dataslice: xr.Dataset) -> xr.Variable:
+        # Encode the slice like the existing variable in memory,
+        # rather than writing it to a temporary Zarr and reading it back
+        slice_var = dataslice[var_name].variable.transpose(
+            *var_array.attrs['_ARRAY_DIMENSIONS']
+        )
+        slice_var.encoding = _get_cf_encoding(var_array, slice_var)
+        return encode_cf_variable(slice_var, name=var_name)
+
+    def _get_append_dim_arrays(self) -> Dict[str, zarr.Array]:
+        if self._append_dim_arrays is None:
+            # We read dimensions directly from the Zarr arrays,
+            # rather than opening the store once more using xarray.
+            root_group = zarr.open(self._store, mode='r+')
+            append_dim_arrays = {}
+            for var_name, var_array in root_group.arrays():
+                var_dims = var_array.attrs.get('_ARRAY_DIMENSIONS', [])
+                if self._dimension in var_dims:
+                    if var_dims[0] != self._dimension:
+                        # TODO: Remove this restriction -- it's not
+                        #   fundamentally necessary. Removal should be
+                        #   accompanied by appropriate unit tests and the
+                        #   addition of a warning to the user about
+                        #   potential slowness / inefficiency.
+                        raise ValueError(
+                            f"dimension '{self._dimension}' of variable "
+                            f"{var_name!r} must be first dimension")
+                    append_dim_arrays[var_name] = var_array
+            self._append_dim_arrays = append_dim_arrays
+        return self._append_dim_arrays
+
+
 def find_slice(store: Union[str, MutableMapping],
                target_value,
                dimension: str,
@@ -58,32 +297,42 @@ def find_slice(store: Union[str, MutableMapping],
     :return: A tuple (insert_index, 'insert') or (insert_index, 'replace') if an
              index was found, (-1, 'create') or (-1, 'append') otherwise.
     """
-    try:
-        cube = xr.open_dataset(store, engine="zarr")
-    except (GroupNotFoundError, PathNotFoundError, FileNotFoundError):
-        # zarr directory does not exist
-        return -1, 'create'
+    return DataSliceAppender(store, dimension=dimension,
+                             epsilon=epsilon).find(target_value)
 
-    # TODO (forman): optimise following naive search by bi-sectioning or so
-    for i in range(cube[dimension].size):
-        value = cube[dimension][i]
-        if abs(target_value - value) < epsilon:
-            return i, 'replace'
-        if target_value < value:
-            return i, 'insert'
 
-    return -1, 'append'
+def _get_last_value(store: Union[str, MutableMapping], dimension: str):
+    """Get the last, CF-decoded value of the 1-D variable *dimension*
+    in *store*, or None if it cannot be determined.
+    """
+    try:
+        array = zarr.open_group(store, mode='r')[dimension]
+    except (GroupNotFoundError, PathNotFoundError, FileNotFoundError,
+            KeyError):
+        return None
+    if array.ndim != 1 or array.shape[0] == 0:
+        return None
+    attrs = array.attrs.asdict()
+    attrs.pop('_ARRAY_DIMENSIONS', None)
+    if array.fill_value is not None:
+        attrs['_FillValue'] = array.fill_value
+    var = xr.Variable((dimension,), array[-1:], attrs)
+    return decode_cf_variable(dimension, var).values[0]
 
 
 def append_slice(store: Union[str, MutableMapping],
                  dataslice: xr.Dataset,
-                 dimension: str = "time") -> None:
+                 dimension: str = "time",
+                 consolidate: bool = True) -> None:
     """
     Append data slice to existing zarr dataset.
 
     :param store: A zarr store.
     :param dataslice: Data slice to insert
     :param dimension: name of dimension perpendicular to the slice
+    :param consolidate: whether to consolidate metadata. If False,
+                        consolidated metadata is removed rather than
+                        updated, so the caller must consolidate it later.
     """
 
     # Unfortunately slice.to_zarr(store, mode='a', append_dim='time') will
@@ -99,14 +348,18 @@ def append_slice(store: Union[str, MutableMapping],
         # exists from next slice.to_zarr(...) call.
         dataslice.attrs.pop('coordinates')
 
-    dataslice.to_zarr(store, mode='a', append_dim=dimension)
+    if not consolidate:
+        _remove_consolidated_metadata(store)
+    dataslice.to_zarr(store, mode='a', append_dim=dimension,
+                      consolidated=None if consolidate else False)
 
 
 def update_slice(store: Union[str, MutableMapping],
                  insert_index: int,
                  dataslice: xr.Dataset,
                  mode: str,
-                 dimension: str = "time") -> None:
+                 dimension: str = "time",
+                 consolidate: bool = True) -> None:
     """
     Update existing Zarr dataset with new data slice.
 
@@ -115,71 +368,95 @@ def update_slice(store: Union[str, MutableMapping],
     :param dataslice: slice to insert
     :param mode: Update mode, 'insert' or 'replace'
     :param dimension: name of dimension perpendicular to slice
+    :param consolidate: whether to consolidate metadata, if *store* has
+        consolidated metadata. If False, consolidated metadata is removed
+        rather than updated, so the caller must consolidate it later.
     """
 
     if mode not in ('insert', 'replace'):
         raise ValueError(f'illegal mode value: {mode!r}')
 
-    insert_mode = mode == 'insert'
-
-    append_dim_var_names = []
-    encoding = {}
-
     # Neither Zarr nor xarray offer an explicit API function to check whether
     # a Zarr is consolidated. Here we use the workaround of attempting to
     # open as consolidated, and catching the resulting exception if this
-    # isn't possible. In the case of a consolidated Zarr, there is a slight
-    # inefficiency, since the consolidated metadata object is fetched twice
-    # (by Zarr and thereafter by xarray). See comments on PR #48 for
-    # discussion of possible optimizations.
+    # isn't possible.
     consolidated = True
     try:
         _ = zarr.open_consolidated(store)
     except KeyError:
         consolidated = False
 
-    with xr.open_zarr(store, consolidated=consolidated) as ds:
-        for var_name in ds.variables:
-            var = ds[var_name]
-            if var.ndim >= 1 and dimension in var.dims:
-                if var.dims[0] != dimension:
-                    # TODO: Remove this restriction -- it's not fundamentally
-                    #   necessary. Removal should be accompanied by appropriate
-                    #   unit tests and the addition of a warning to the user
-                    #   about potential slowness / inefficiency.
-                    raise ValueError(
-                        f"dimension '{dimension}' of variable "
-                        f"{var_name!r} must be first dimension")
-                append_dim_var_names.append(var_name)
-                enc = dict(ds[var_name].encoding)
-                # xarray 0.17+ supports engine preferred chunks if exposed by
-                # the backend zarr does that, but when we use the new
-                # 'preferred_chunks' when writing to zarr it raises and says,
-                # 'preferred_chunks' is an unsupported encoding
-                if 'preferred_chunks' in enc:
-                    del enc['preferred_chunks']
-                encoding[var_name] = enc
-
-    temp_dir = tempfile.TemporaryDirectory(prefix='nc2zarr-slice-',
-                                           suffix='.zarr')
-    dataslice.to_zarr(temp_dir.name, encoding=encoding)
-    slice_root_group = zarr.open(temp_dir.name, mode='r')
-    slice_arrays = dict(slice_root_group.arrays())
-
-    root_group = zarr.open(store, mode='r+')
-    for var_name, var_array in root_group.arrays():
-        if var_name in append_dim_var_names:
-            slice_array = slice_arrays[var_name]
-            if insert_mode:
-                # Add one empty step
-                empty = zarr.creation.empty(slice_array.shape,
-                                            dtype=var_array.dtype)
-                var_array.append(empty, axis=0)
-                # Shift contents
-                var_array[insert_index + 1:, ...] = \
-                    var_array[insert_index:-1, ...]
-            # Replace slice
-            var_array[insert_index, ...] = slice_array[0]
+    if consolidated and not consolidate:
+        _remove_consolidated_metadata(store)
 
-    if consolidated:
+    DataSliceAppender(store, dimension=dimension).update(insert_index,
+                                                         dataslice,
+                                                         mode)
+
+    if consolidated and consolidate:
         zarr.consolidate_metadata(store)
+
+
+def _remove_consolidated_metadata(store: Union[str, MutableMapping]) -> None:
+    """Remove consolidated metadata from *store*, if any, so that readers
+    do not see outdated metadata until it is consolidated again.
+    """
+    store = zarr.open_group(store, mode='r+').store
+    if '.zmetadata' in store:
+        del store['.zmetadata']
+
+
+def _for_each_array(func: Callable[[str, zarr.Array], None],
+                    arrays: Dict[str, zarr.Array],
+                    num_workers: int) -> None:
+    """Call *func* for each name and array of *arrays*.
+
+    Arrays are independent of each other and compression releases
+    the GIL, so arrays are processed in up to *num_workers* threads.
+    """
+    max_workers = min(len(arrays), num_workers)
+    if max_workers <= 1:
+        for var_name, var_array in arrays.items():
+            func(var_name, var_array)
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) \
+            as executor:
+        futures = [executor.submit(func, var_name, var_array)
+                   for var_name, var_array in arrays.items()]
+        for future in futures:
+            future.result()
+
+
+def _get_cf_encoding(array: zarr.Array,
+                     var: xr.Variable) -> Dict[str, Any]:
+    """Get the CF encoding of *var* that yields the values
+    stored in Zarr *array*, as xarray would derive it from *array*.
+    """
+    attrs = array.attrs.asdict()
+    encoding = {k: attrs[k]
+                for k in ('scale_factor', 'add_offset', '_Unsigned')
+                if k in attrs}
+    if var.dtype.kind in 'mM':
+        # Only datetimes and timedeltas have been decoded using units
+        encoding.update({k: attrs[k]
+                         for k in ('units', 'calendar')
+                         if k in attrs})
+    if array.fill_value is not None:
+        encoding['_FillValue'] = array.fill_value
+    encoding['dtype'] = array.dtype
+    return encoding
+
+
+def _shift_tail(array: zarr.Array, index: int) -> None:
+    """Shift the items of *array* from *index* on by one step along
+    the first dimension, dropping the last item.
+
+    Items are shifted chunk by chunk starting from the tail, so that every
+    chunk is written exactly once and memory is bounded by the chunk size.
+    """
+    chunk_size = array.chunks[0]
+    stop = array.shape[0]
+    while stop > index + 1:
+        start = max(index + 1, ((stop - 1) // chunk_size) * chunk_size)
+        array[start:stop, ...] = array[start - 1:stop - 1, ...]
+        stop = start
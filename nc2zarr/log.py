@@ -24,15 +24,50 @@ import logging
 import sys
 import time
 
+
+class _LogFormatter(logging.Formatter):
+    """
+    A formatter that formats the seconds part of a record's
+    time stamp only once per second.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._last_second = None
+        self._last_second_text = None
+
+    def formatTime(self, record: logging.LogRecord, datefmt: str = None) -> str:
+        if datefmt:
+            return super().formatTime(record, datefmt=datefmt)
+        second = int(record.created)
+        if second != self._last_second:
+            self._last_second_text = time.strftime(self.default_time_format,
+                                                   self.converter(second))
+            self._last_second = second
+        return self.default_msec_format % (self._last_second_text,
+                                           record.msecs)
+
+
+def _new_log_handler() -> logging.Handler:
+    handler = logging.StreamHandler(stream=sys.stderr)
+    handler.setFormatter(
+        _LogFormatter('%(asctime)s: %(levelname)s: %(name)s: %(message)s')
+    )
+    return handler
+
+
 logging.basicConfig(
     level=logging.WARNING,
-    format='%(asctime)s: %(levelname)s: %(name)s: %(message)s',
-    stream=sys.stderr,
+    handlers=[_new_log_handler()],
 )
 
 LOGGER = logging.getLogger('nc2zarr')
 LOGGER.setLevel(logging.WARNING)
 
+_perf_counter = time.perf_counter
+
+_VERBOSITY_LEVELS = (logging.WARNING, logging.INFO, logging.DEBUG)
+
 
 def get_verbosity() -> int:
     if LOGGER.level == logging.INFO:
@@ -53,16 +88,12 @@ def use_verbosity(new_verbosity: int):
 
 def set_verbosity(verbosity: int) -> int:
     old_verbosity = get_verbosity()
-    if verbosity == 1:
-        LOGGER.setLevel(logging.INFO)
-    elif verbosity >= 2:
-        LOGGER.setLevel(logging.DEBUG)
-    else:
-        LOGGER.setLevel(logging.WARNING)
+    LOGGER.setLevel(_VERBOSITY_LEVELS[min(max(verbosity, 0), 2)])
     return old_verbosity
 
 
-class log_duration(contextlib.AbstractContextManager):
+class log_duration:
+    __slots__ = ('tag', 'start', 'duration')
 
     def __init__(self, tag: str = None):
         self.tag = tag or 'task'
@@ -70,13 +101,17 @@ class log_duration(contextlib.AbstractContextManager):
         self.duration = None
 
     def __enter__(self):
-        self.start = time.perf_counter()
-        LOGGER.debug(f'{self.tag}...')
+        self.start = _perf_counter()
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug('%s...', self.tag)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.duration = time.perf_counter() - self.start
-        if not any((exc_type, exc_value, traceback)):
-            LOGGER.info(f'{self.tag} done: took {self.duration:,.2f} seconds')
+        self.duration = _perf_counter() - self.start
+        if exc_type is None:
+            if LOGGER.isEnabledFor(logging.INFO):
+                LOGGER.info('%s done: took %s seconds',
+                            self.tag, f'{self.duration:,.2f}')
         else:
-            LOGGER.error(f'{self.tag} failed: took {self.duration:,.2f} seconds')
+            LOGGER.error('%s failed: took %s seconds',
+                         self.tag, f'{self.duration:,.2f}')
@@ -19,13 +19,21 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import collections
+import concurrent.futures
+import contextlib
+import fnmatch
 import glob
+import logging
 import os.path
+import re
 import warnings
 from typing import List, Optional, Iterator, Callable, Union, Dict, Hashable
 
+import dask
 import xarray as xr
 
+from .constants import DEFAULT_INPUT_PREFETCH_DEPTH
 from .error import ConverterError
 from .log import LOGGER
 from .log import log_duration
@@ -37,16 +45,24 @@ class DatasetOpener:
                  *,
                  input_multi_file: bool = False,
                  input_sort_by: str = None,
+                 input_variables: List[str] = None,
                  input_decode_cf: bool = False,
                  input_concat_dim: str = None,
                  input_engine: str = None,
-                 input_prefetch_chunks: bool = False):
+                 input_chunks: Dict[Hashable, int] = None,
+                 input_prefetch_chunks: bool = False,
+                 input_prefetch_depth: int = DEFAULT_INPUT_PREFETCH_DEPTH,
+                 input_parallel: bool = False,
+                 input_chunk_cache_size: int = None):
         """Instantiate a new DatasetOpener object
 
         :param input_paths: paths of files to open
         :param input_multi_file: True to read all input files as one block,
                using xarray.open_mfdataset
         :param input_sort_by: how to sort input paths: "name", "path", or None
+        :param input_variables: names of variables to keep, if given.
+               Other variables found in the first input are not read
+               from subsequent inputs.
         :param input_decode_cf: True to decode inputs according to CF
                conventions
         :param input_concat_dim: name of dimension to be used for concatenation
@@ -55,29 +71,76 @@ class DatasetOpener:
                mode; if concat_dim is omitted or set to None,
                xarray.open_mfdataset's "by_coords" mode will be used instead.
         :param input_engine: xarray engine used for opening the dataset
+        :param input_chunks: mapping from dimension names to chunk sizes
+               used to open all input files as Dask arrays, so only
+               the required parts of inputs are read. Overrides
+               chunk sizes found by input_prefetch_chunks.
         :param input_prefetch_chunks:  Open one input to fetch internal
                chunking, if any. Then use this chunking to open all input files
                (and force using Dask arrays). This may slow down the process
                slightly, but may be required to avoid memory problems for very
                large inputs.
+        :param input_prefetch_depth: Number of subsequent input files
+               opened and pre-processed in background threads, while an
+               input is being processed. If 0, inputs are opened in the
+               calling thread. Should only be greater than 0 for
+               thread-safe backends and preprocessors.
+               Not used if input_multi_file is true.
+        :param input_parallel: True to open and preprocess input files
+               in parallel using Dask, if input_multi_file is true.
+               Unless a Dask scheduler is configured, files are
+               opened in separate processes.
+        :param input_chunk_cache_size: Size in bytes of the netCDF chunk
+               cache used for each variable of files opened with the
+               "netcdf4" engine. If not given, the netCDF library's
+               default is used. The previous size is restored once
+               all datasets have been consumed. Not applied to files
+               opened in worker processes if input_parallel is true.
         """
+        if input_prefetch_depth is None:
+            input_prefetch_depth = DEFAULT_INPUT_PREFETCH_DEPTH
+        if input_prefetch_depth < 0:
+            raise ConverterError(f'Input prefetch depth must not be'
+                                 f' negative, got {input_prefetch_depth}.')
         self._input_paths = input_paths
         self._input_multi_file = input_multi_file
         self._input_sort_by = input_sort_by
+        self._input_variables = frozenset(input_variables) \
+            if input_variables else None
+        self._drop_variables: Optional[List[str]] = None
         self._input_decode_cf = input_decode_cf
         self._input_concat_dim = input_concat_dim
         self._input_engine = input_engine
+        self._input_chunks = dict(input_chunks) if input_chunks else None
         self._input_prefetch_chunks = input_prefetch_chunks
+        self._input_prefetch_depth = input_prefetch_depth
+        self._input_parallel = input_parallel
+        self._input_chunk_cache_size = input_chunk_cache_size
+        self._resolved_input_paths: Optional[List[str]] = None
+        self._prefetched_chunk_sizes: Optional[Dict[Hashable, int]] = None
 
     def open_datasets(self,
                       preprocess: Callable[[xr.Dataset], xr.Dataset] = None) \
             -> Iterator[xr.Dataset]:
         input_paths = self._resolve_input_paths()
-        chunks = self._prefetch_chunk_sizes(input_paths[0])
+        chunks = self._get_chunk_sizes(input_paths[0])
         if self._input_multi_file:
-            return self._open_mfdataset(input_paths, chunks, preprocess)
+            datasets = self._open_mfdataset(input_paths, chunks, preprocess)
         else:
-            return self._open_datasets(input_paths, chunks, preprocess)
+            datasets = self._open_datasets(input_paths, chunks, preprocess)
+        return self._with_chunk_cache(datasets, input_paths[0])
+
+    def _with_chunk_cache(self,
+                          datasets: Iterator[xr.Dataset],
+                          input_file: str) -> Iterator[xr.Dataset]:
+        # The chunk cache size is global state of the netCDF library,
+        # so it is restored once all datasets have been consumed.
+        restore_chunk_cache = self._set_chunk_cache(input_file)
+        try:
+            yield from datasets
+        finally:
+            if restore_chunk_cache is not None:
+                restore_chunk_cache()
 
     def _open_mfdataset(
             self,
@@ -86,54 +149,169 @@ class DatasetOpener:
             preprocess: Callable[[xr.Dataset], xr.Dataset] = None
     ) -> xr.Dataset:
         with log_duration(f'Opening {len(input_paths)} file(s)'):
-            combine = 'nested'
-            if not self._input_concat_dim:
-                combine = 'by_coords'
+            # Only concatenate variables that have the concatenation
+            # dimension and take all others from the first file, rather
+            # than comparing them across all files, see
+            # https://github.com/pydata/xarray/issues/1385
+            combine_kwargs = dict(data_vars='minimal',
+                                  coords='minimal',
+                                  compat='override')
+            if self._input_concat_dim:
+                # Inputs are expected to share all other dimensions,
+                # so take their indexes from the first file rather
+                # than aligning them across all files.
+                combine_kwargs.update(combine='nested',
+                                      concat_dim=self._input_concat_dim,
+                                      join='override')
+            else:
                 warnings.warn(f'input/concat_dim is not specified, '
                               f'combining by coordinates')
-            ds = xr.open_mfdataset(
-                input_paths,
-                engine=self._input_engine,
-                preprocess=preprocess,
-                concat_dim=self._input_concat_dim,
-                decode_cf=self._input_decode_cf,
-                chunks=chunks,
-                combine=combine
-            )
+                combine_kwargs.update(combine='by_coords')
+            with self._get_open_scheduler_config(len(input_paths)):
+                ds = xr.open_mfdataset(
+                    input_paths,
+                    engine=self._input_engine,
+                    preprocess=preprocess,
+                    decode_cf=self._input_decode_cf,
+                    chunks=chunks,
+                    parallel=self._input_parallel,
+                    **combine_kwargs
+                )
         yield ds
 
+    def _get_open_scheduler_config(self, num_inputs: int) \
+            -> contextlib.AbstractContextManager:
+        if not self._input_parallel or dask.config.get('scheduler', None):
+            return contextlib.nullcontext()
+        # The HDF5 library serializes reads from multiple threads
+        # by a global lock, so inputs are opened in parallel
+        # using processes rather than threads.
+        return dask.config.set(scheduler='processes',
+                               num_workers=min(os.cpu_count() or 1,
+                                               num_inputs))
+
     def _open_datasets(self,
                        input_paths: List[str],
                        chunks: Optional[Dict[Hashable, int]],
                        preprocess: Callable[[xr.Dataset], xr.Dataset] = None) \
             -> Iterator[xr.Dataset]:
         n = len(input_paths)
-        for i in range(n):
-            input_file = input_paths[i]
-            LOGGER.info(f'Processing input {i + 1} of {n}: {input_file}')
-            with log_duration('Opening'):
-                ds = xr.open_dataset(input_file,
-                                     engine=self._get_engine(input_file),
-                                     decode_cf=self._input_decode_cf,
-                                     chunks=chunks)
-                if preprocess:
-                    ds = preprocess(ds)
-            yield ds
+        depth = self._input_prefetch_depth
+        if not depth:
+            for i, input_path in enumerate(input_paths):
+                LOGGER.info('Processing input %d of %d: %s',
+                            i + 1, n, input_path)
+                yield self._open_dataset(input_path, chunks, preprocess)
+            return
+        # Up to depth subsequent inputs are opened and pre-processed
+        # in the background, while input i is being consumed.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=depth) \
+                as executor:
+            futures = collections.deque()
+            try:
+                for i in range(n):
+                    while len(futures) <= depth and i + len(futures) < n:
+                        futures.append(
+                            executor.submit(self._open_dataset,
+                                            input_paths[i + len(futures)],
+                                            chunks,
+                                            preprocess)
+                        )
+                    future = futures.popleft()
+                    LOGGER.info('Processing input %d of %d: %s',
+                                i + 1, n, input_paths[i])
+                    yield future.result()
+            finally:
+                # Close datasets that have been opened
+                # but will no longer be consumed.
+                for future in futures:
+                    if not future.cancel():
+                        try:
+                            future.result().close()
+                        except Exception:
+                            pass
+
+    def _open_dataset(self,
+                      input_file: str,
+                      chunks: Optional[Dict[Hashable, int]],
+                      preprocess: Callable[[xr.Dataset], xr.Dataset] = None) \
+            -> xr.Dataset:
+        with log_duration(f'Opening {input_file}'):
+            ds = xr.open_dataset(input_file,
+                                 engine=self._get_engine(input_file),
+                                 decode_cf=self._input_decode_cf,
+                                 chunks=chunks,
+                                 drop_variables=self._drop_variables)
+            if self._input_variables and self._drop_variables is None:
+                # Inputs usually share the same variables, so let the
+                # backend skip the unwanted ones of the first input when
+                # opening subsequent inputs. Pre-processing still drops
+                # unwanted variables that are not known by then.
+                self._drop_variables = sorted(map(str,
+                                                  ds.variables.keys()
+                                                  - self._input_variables))
+            if preprocess:
+                ds = preprocess(ds)
+        return ds
+
+    def _set_chunk_cache(self, input_file: str) \
+            -> Optional[Callable[[], None]]:
+        if not self._input_chunk_cache_size:
+            return None
+        # If no engine is given, xarray opens netCDF files
+        # using the "netcdf4" engine, if it is installed.
+        if self._get_engine(input_file) not in (None, 'netcdf4'):
+            return None
+        try:
+            import netCDF4
+        except ImportError:
+            if self._input_engine == 'netcdf4':
+                LOGGER.warning('Cannot set chunk cache size,'
+                               ' netCDF4 is not installed')
+            return None
+        size, nelems, preemption = netCDF4.get_chunk_cache()
+        netCDF4.set_chunk_cache(size=self._input_chunk_cache_size,
+                                nelems=nelems,
+                                preemption=preemption)
+
+        def restore_chunk_cache():
+            netCDF4.set_chunk_cache(size=size,
+                                    nelems=nelems,
+                                    preemption=preemption)
+
+        return restore_chunk_cache
+
+    def _get_chunk_sizes(self, input_file: str) -> Optional[Dict[Hashable, int]]:
+        chunk_sizes = self._prefetch_chunk_sizes(input_file)
+        if not self._input_chunks:
+            return chunk_sizes
+        return {**(chunk_sizes or {}), **self._input_chunks}
 
     def _prefetch_chunk_sizes(self, input_file: str) -> Optional[Dict[Hashable, int]]:
         if not self._input_prefetch_chunks:
             return None
+        if self._prefetched_chunk_sizes is not None:
+            return self._prefetched_chunk_sizes
         with log_duration('Pre-fetching chunks'):
+            # Only metadata is needed here, so do not decode
+            # values, but keep decoding which variables are coordinates.
             with xr.open_dataset(input_file,
                                  engine=self._get_engine(input_file),
-                                 decode_cf=self._input_decode_cf) as ds:
+                                 decode_cf=self._input_decode_cf,
+                                 mask_and_scale=False,
+                                 decode_times=False,
+                                 decode_timedelta=False) as ds:
+                coord_names = ds.coords.keys()
                 chunk_sizes = dict()
-                for var in ds.data_vars.values():
+                for var_name, var in ds.variables.items():
+                    if var_name in coord_names:
+                        continue
                     sizes = var.encoding.get('chunksizes')
                     if sizes and len(sizes) == len(var.dims):
                         for dim, size in zip(var.dims, sizes):
                             chunk_sizes[dim] = max(size, chunk_sizes.get(dim, 0))
-                return chunk_sizes
+        self._prefetched_chunk_sizes = chunk_sizes
+        return chunk_sizes
 
     def _get_engine(self, input_file: str) -> Optional[str]:
         engine = self._input_engine
@@ -142,12 +320,17 @@ class DatasetOpener:
         return engine
 
     def _resolve_input_paths(self) -> List[str]:
+        if self._resolved_input_paths is not None:
+            return self._resolved_input_paths
         input_files = self.resolve_input_paths(self._input_paths, self._input_sort_by)
         if not input_files:
             raise ConverterError('No inputs given.')
-        LOGGER.info(f'{len(input_files)} input(s) found:\n'
-                    + ('\n'.join(map(lambda f: f'  {f[0]}: ' + f[1],
-                                     zip(range(len(input_files)), input_files)))))
+        if LOGGER.isEnabledFor(logging.INFO):
+            LOGGER.info('%d input(s) found:\n%s',
+                        len(input_files),
+                        '\n'.join(f'  {i}: {f}'
+                                  for i, f in enumerate(input_files)))
+        self._resolved_input_paths = input_files
         return input_files
 
     @classmethod
@@ -164,35 +347,87 @@ class DatasetOpener:
         for input_path in input_paths:
             input_path = os.path.expanduser(input_path)
             if '*' in input_path or '?' in input_path:
-                glob_result = glob.glob(input_path, recursive=True)
-                if not glob_result:
+                num_resolved_input_files = len(resolved_input_files)
+                resolved_input_files.extend(_iglob(input_path))
+                if len(resolved_input_files) == num_resolved_input_files:
                     raise ConverterError(f'No inputs found for wildcard: "{input_path}"')
-                resolved_input_files.extend(glob_result)
             else:
                 if not os.path.exists(input_path):
                     raise ConverterError(f'Input not found: "{input_path}"')
                 resolved_input_files.append(input_path)
 
         if sort_by:
+            try:
+                sort_key = _SORT_KEYS[sort_by]
+            except (KeyError, TypeError):
+                raise ConverterError(f'Can sort by "path" or "name" only, got "{sort_by}".')
             # Get rid of doubles and sort
-            resolved_input_files = set(resolved_input_files)
-            if sort_by == 'path' or sort_by is True:
-                return sorted(resolved_input_files)
-            if sort_by == 'name':
-                return sorted(resolved_input_files, key=_sort_by_name_key)
-            raise ConverterError(f'Can sort by "path" or "name" only, got "{sort_by}".')
+            return sorted(set(resolved_input_files), key=sort_key)
         else:
             # Get rid of doubles, but preserve order
-            seen_input_files = set()
-            unique_input_files = []
-            for input_file in resolved_input_files:
-                if input_file not in seen_input_files:
-                    unique_input_files.append(input_file)
-                    seen_input_files.add(input_file)
-            return unique_input_files
+            return list(dict.fromkeys(resolved_input_files))
+
+
+def _iglob(input_path: str) -> Iterator[str]:
+    """
+    Like ``glob.iglob(input_path, recursive=True)``, but uses a
+    single ``os.scandir()`` walk and a pre-compiled name pattern
+    for the common case ``<dir>/**/<name-pattern>``.
+
+    :param input_path: the wildcard path
+    :return: an iterator over the matching paths
+    """
+    head, name_pattern = os.path.split(input_path)
+    root_dir, recursive = os.path.split(head)
+    if recursive != '**' \
+            or not name_pattern \
+            or name_pattern == '**' \
+            or glob.has_magic(root_dir):
+        return glob.iglob(input_path, recursive=True)
+    return _iglob_recursive(root_dir, name_pattern)
+
+
+def _iglob_recursive(root_dir: str, name_pattern: str) -> Iterator[str]:
+    match_name = re.compile(
+        fnmatch.translate(os.path.normcase(name_pattern))
+    ).match
+    match_hidden = name_pattern.startswith('.')
+    dir_paths = [root_dir]
+    while dir_paths:
+        dir_path = dir_paths.pop()
+        try:
+            with os.scandir(dir_path or os.curdir) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        sub_dir_paths = []
+        for entry in entries:
+            name = entry.name
+            hidden = name.startswith('.')
+            path = os.path.join(dir_path, name)
+            if (match_hidden or not hidden) \
+                    and match_name(os.path.normcase(name)):
+                yield path
+            if not hidden:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    sub_dir_paths.append(path)
+        # Visit sub-directories in directory order
+        dir_paths.extend(reversed(sub_dir_paths))
+
+
+_PATH_SEPARATORS = '/' + os.path.sep
 
 
 def _sort_by_name_key(path: str) -> str:
-    while path.endswith('/') or path.endswith(os.path.sep):
-        path = path[0:-1]
-    return os.path.basename(path)
+    return os.path.basename(path.rstrip(_PATH_SEPARATORS))
+
+
+_SORT_KEYS = {
+    'path': None,
+    True: None,
+    'name': _sort_by_name_key,
+}
@@ -19,6 +19,8 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import functools
+import logging
 from datetime import datetime
 from typing import List
 from typing import Tuple, Optional
@@ -37,7 +39,8 @@ class DatasetPreProcessor:
                  input_custom_preprocessor: str = None,
                  input_concat_dim: str = None,
                  input_datetime_format: str = None):
-        self._input_variables = input_variables
+        self._input_variables = frozenset(input_variables) \
+            if input_variables else None
         self._input_custom_preprocessor = load_custom_func(input_custom_preprocessor) \
             if input_custom_preprocessor else None
         self._input_concat_dim = input_concat_dim
@@ -46,15 +49,20 @@ class DatasetPreProcessor:
 
     def preprocess_dataset(self, ds: xr.Dataset) -> xr.Dataset:
         if self._input_variables:
-            drop_variables = set(ds.variables).difference(self._input_variables)
-            ds = ds.drop_vars(drop_variables)
+            input_variables = self._input_variables
+            drop_variables = [var_name for var_name in ds.variables.keys()
+                              if var_name not in input_variables]
+            if drop_variables:
+                ds = ds.drop_vars(drop_variables)
         if self._input_custom_preprocessor is not None:
             ds = self._input_custom_preprocessor(ds)
         if self._input_concat_dim:
             ds = ensure_dataset_has_concat_dim(ds, self._input_concat_dim,
                                                datetime_format=self._input_datetime_format)
         if not self._first_dataset_shown:
-            LOGGER.debug(f'First input dataset:\n{ds}')
+            # Formatting a dataset is costly, so only do it if shown
+            if LOGGER.isEnabledFor(logging.DEBUG):
+                LOGGER.debug(f'First input dataset:\n{ds}')
             self._first_dataset_shown = True
         return ds
 
@@ -70,6 +78,13 @@ def ensure_dataset_has_concat_dim(ds: xr.Dataset,
     :param datetime_format: Name of dimension to be appended
     :return: Adjusted dataset
     """
+    concat_dim_variable = ds.variables.get(concat_dim_name)
+    if concat_dim_variable is not None \
+            and concat_dim_variable.dims \
+            and _is_dim_used_by_data_vars(ds, concat_dim_name):
+        # Common case, nothing to do
+        return ds
+
     concat_dim_var = None
     if concat_dim_name in ds:
         concat_dim_var = ds[concat_dim_name]
@@ -107,9 +122,7 @@ def ensure_dataset_has_concat_dim(ds: xr.Dataset,
                              f'"{concat_dim_name}" for dimension '
                              f'"{concat_dim_name}".')
 
-    is_concat_dim_used = any((concat_dim_name in ds[var_name].dims)
-                             for var_name in ds.data_vars)
-    if not is_concat_dim_used:
+    if not _is_dim_used_by_data_vars(ds, concat_dim_name):
         concat_dim_bnds_name = concat_dim_var.attrs.get('bounds',
                                                         f'{concat_dim_name}_bnds')
         concat_dim_bnds_var = ds[concat_dim_bnds_name] \
@@ -143,6 +156,17 @@ def ensure_dataset_has_concat_dim(ds: xr.Dataset,
     return ds
 
 
+def _is_dim_used_by_data_vars(ds: xr.Dataset, dim_name: str) -> bool:
+    if dim_name not in ds.dims:
+        return False
+    # Look at the variables directly, ds[var_name] would
+    # construct a DataArray including its coordinates
+    coord_names = ds.coords.keys()
+    return any(dim_name in var.dims
+               for var_name, var in ds.variables.items()
+               if var_name not in coord_names)
+
+
 def get_time_coverage_from_ds(ds: xr.Dataset,
                               datetime_format: str = None) -> Tuple[datetime, datetime]:
     time_coverage_start = ds.attrs.get('time_coverage_start')
@@ -169,6 +193,24 @@ def get_time_coverage_from_ds(ds: xr.Dataset,
 
 def parse_timestamp(string: str, datetime_format: str = None) \
         -> Optional[datetime]:
+    if isinstance(string, str):
+        return _parse_timestamp(string, datetime_format)
+    return _parse_timestamp.__wrapped__(string, datetime_format)
+
+
+# Inputs often share the same time coverage attributes,
+# e.g. if they are slices of the same period, so
+# remember the most recently parsed timestamps
+@functools.lru_cache(maxsize=4096)
+def _parse_timestamp(string: str, datetime_format: Optional[str]) \
+        -> Optional[datetime]:
+    if datetime_format and isinstance(string, str):
+        try:
+            # Much faster than pd.to_datetime() for single values
+            return datetime.strptime(string, datetime_format)
+        except ValueError:
+            # Let pandas try, it supports more format directives
+            pass
     try:
         return pd.to_datetime(string, format=datetime_format)
     except ValueError as e:
@@ -19,7 +19,7 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
-from typing import Any, Tuple, Dict
+from typing import Any, Callable, Tuple, Dict, Hashable, Optional
 
 import xarray as xr
 
@@ -31,22 +31,46 @@ class DatasetProcessor:
                  process_rename: Dict[str, str] = None,
                  process_rechunk: Dict[str, Any] = None,
                  process_custom_processor: str = None,
+                 process_rechunk_max_mem: str = None,
                  output_encoding: Dict[str, Dict[str, Any]] = None):
         self._process_rename = process_rename
         self._process_rechunk = process_rechunk
+        self._rechunk_rules = _get_rechunk_rules(process_rechunk) \
+            if process_rechunk else None
+        # If given, rechunking is left to the writer,
+        # which uses the "rechunker" package
+        self._process_rechunk_max_mem = process_rechunk_max_mem
         self._process_custom_processor = load_custom_func(process_custom_processor) \
             if process_custom_processor else None
         self._output_encoding = output_encoding
 
-    def process_dataset(self, ds: xr.Dataset) -> Tuple[xr.Dataset, Dict[str, Dict[str, Any]]]:
+    def process_dataset(self,
+                        ds: xr.Dataset,
+                        with_encoding: bool = True) \
+            -> Tuple[xr.Dataset, Optional[Dict[str, Dict[str, Any]]]]:
+        """Process the given dataset.
+
+        :param ds: the dataset to be processed
+        :param with_encoding: whether to also compute the output encoding.
+            May be set to False if the dataset is appended to an existing
+            output, in which case the encoding is not used.
+        :return: the processed dataset and its output encoding,
+            or None if *with_encoding* is False.
+        """
         if self._process_rename:
             ds = ds.rename(self._process_rename)
         if self._process_custom_processor is not None:
             ds = self._process_custom_processor(ds)
         if self._process_rechunk:
-            ds, chunk_encoding = self._rechunk_dataset(ds, self._process_rechunk)
+            ds, chunk_encoding = self._rechunk_dataset(
+                ds,
+                self._rechunk_rules,
+                encoding_only=bool(self._process_rechunk_max_mem)
+            )
         else:
             chunk_encoding = dict()
+        if not with_encoding:
+            return ds, None
         return ds, self._merge_encodings(ds,
                                          chunk_encoding,
                                          self._output_encoding or {})
@@ -54,48 +78,40 @@ class DatasetProcessor:
     @classmethod
     def _rechunk_dataset(cls,
                          ds: xr.Dataset,
-                         process_rechunk: Dict[str, Dict[str, int]]) \
+                         rechunk_rules: Dict[str, Callable[[Hashable], Any]],
+                         encoding_only: bool = False) \
             -> Tuple[xr.Dataset, Dict[str, Dict[str, Any]]]:
-        ds_rechunked = ds.copy()
+        ds_rechunked = ds.copy() if not encoding_only else ds
         output_encoding = dict()
-        all_dim_chunk_sizes = process_rechunk.get('*', {})
+        default_rule = rechunk_rules['*']
         for k, v in ds.variables.items():
             var_name = str(k)
-            # Compute default chunk sizes for dims of v
-            dim_chunk_sizes = dict(all_dim_chunk_sizes)
-            if var_name in process_rechunk:
-                dim_chunk_sizes_update = process_rechunk[var_name]
-                if dim_chunk_sizes_update is None \
-                        or isinstance(dim_chunk_sizes_update, int) \
-                        or dim_chunk_sizes_update == 'input':
-                    dim_chunk_sizes_update = {dim_name: dim_chunk_sizes_update for dim_name in v.dims}
-                elif isinstance(dim_chunk_sizes_update, dict):
-                    dim_chunk_sizes_update = {dim_name: dim_chunk_sizes_update.get(dim_name) for dim_name in v.dims}
-                # Update chunk sizes with defaults for v
-                dim_chunk_sizes.update(dim_chunk_sizes_update)
+            # Variable.dims, .sizes, and .chunks are computed properties,
+            # so look them up once per variable
+            var_dims = v.dims
+            var_sizes = v.sizes
+            var_chunks = v.chunks
+            get_dim_chunk_size = rechunk_rules.get(var_name, default_rule)
             # Now loop through all dims of variable to
             # resolve each dimension's integer chunk size
             chunks = []
-            for dim_index in range(len(v.dims)):
-                dim_name = v.dims[dim_index]
-                dim_chunk_size = dim_chunk_sizes.get(dim_name, 'input')
+            for dim_index, dim_name in enumerate(var_dims):
+                dim_chunk_size = get_dim_chunk_size(dim_name)
                 if dim_chunk_size == 'input':
-                    dim_chunk_size = v.sizes[dim_name]
-                    if v.chunks is not None:
-                        dim_chunks = v.chunks[dim_index]
-                        num_dim_chunks = len(dim_chunks)
-                        if num_dim_chunks > 1:
-                            dim_chunk_size = max(*dim_chunks)
-                        elif num_dim_chunks == 1:
-                            dim_chunk_size = dim_chunks[0]
+                    dim_chunk_size = var_sizes[dim_name]
+                    if var_chunks is not None:
+                        dim_chunks = var_chunks[dim_index]
+                        if dim_chunks:
+                            dim_chunk_size = max(dim_chunks)
                 elif dim_chunk_size is None:
-                    dim_chunk_size = v.sizes[dim_name]
+                    dim_chunk_size = var_sizes[dim_name]
                 elif not isinstance(dim_chunk_size, int):
                     raise ValueError(f'invalid chunk size: {dim_chunk_size}')
                 chunks.append(dim_chunk_size)
             if chunks:
                 chunks = tuple(chunks)
-                ds_rechunked[k] = v.chunk(chunks)
+                if not encoding_only and not _has_chunks(v, chunks):
+                    ds_rechunked[k] = v.chunk(chunks)
                 output_encoding[var_name] = dict(chunks=chunks)
         return ds_rechunked, output_encoding
 
@@ -104,12 +120,60 @@ class DatasetProcessor:
                          ds: xr.Dataset,
                          *encodings: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
         output_encoding = dict()
+        var_names = {str(k) for k in ds.variables.keys()}
         for encoding in encodings:
-            for k, v in ds.variables.items():
-                var_name = str(k)
-                if var_name in encoding:
-                    if var_name not in output_encoding:
-                        output_encoding[var_name] = dict(encoding[var_name])
-                    else:
-                        output_encoding[var_name].update(encoding[var_name])
+            # Encodings are usually much smaller than the dataset,
+            # so only visit their variables
+            for var_name, var_encoding in encoding.items():
+                if var_name not in var_names:
+                    continue
+                if var_name in output_encoding:
+                    output_encoding[var_name].update(var_encoding)
+                else:
+                    output_encoding[var_name] = dict(var_encoding)
         return output_encoding
+
+
+def _get_rechunk_rules(process_rechunk: Dict[str, Any]) \
+        -> Dict[str, Callable[[Hashable], Any]]:
+    """
+    Normalize *process_rechunk* into functions that map a dimension
+    name to the requested chunk size, so the configuration is
+    interpreted once rather than for every variable of every dataset.
+    The function for key "*" is used for variables without own rules.
+    """
+    all_dim_chunk_sizes = dict(process_rechunk.get('*') or {})
+    rechunk_rules = {
+        '*': lambda dim_name: all_dim_chunk_sizes.get(dim_name, 'input')
+    }
+    for var_name, var_chunk_sizes in process_rechunk.items():
+        if var_name == '*':
+            continue
+        if var_chunk_sizes is None \
+                or isinstance(var_chunk_sizes, int) \
+                or var_chunk_sizes == 'input':
+            # Same chunk size for all dimensions of the variable
+            rechunk_rules[var_name] = \
+                lambda dim_name, chunk_size=var_chunk_sizes: chunk_size
+        elif isinstance(var_chunk_sizes, dict):
+            # Dimensions not given use their full size
+            rechunk_rules[var_name] = dict(var_chunk_sizes).get
+        else:
+            raise ValueError(f'invalid chunk sizes for'
+                             f' variable "{var_name}": {var_chunk_sizes}')
+    return rechunk_rules
+
+
+def _has_chunks(var: xr.Variable, chunks: Tuple[int, ...]) -> bool:
+    """Test whether *var* is already chunked as requested by *chunks*."""
+    if var.chunks is None:
+        return False
+    for dim_chunks, dim_size, chunk_size in zip(var.chunks, var.shape, chunks):
+        if chunk_size <= 0:
+            return False
+        num_full_chunks, remainder = divmod(dim_size, chunk_size)
+        expected_dim_chunks = num_full_chunks * (chunk_size,) \
+                              + ((remainder,) if remainder else ())
+        if tuple(dim_chunks) != expected_dim_chunks:
+            return False
+    return True
@@ -22,9 +22,13 @@
 import datetime
 import json
 import os.path
+import shutil
+import tempfile
+import threading
 from enum import Enum
 from typing import Dict, Any, Sequence
 
+import dask
 import fsspec
 import fsspec.implementations.local
 import numpy as np
@@ -32,16 +36,18 @@ import pandas as pd
 import retry.api
 import xarray as xr
 import zarr
+from zarr.errors import ContainsGroupError
 from zarr.errors import GroupNotFoundError
 
 from .constants import DEFAULT_OUTPUT_APPEND_DIM_NAME
 from .constants import DEFAULT_OUTPUT_RETRY_KWARGS
+from .constants import DEFAULT_OUTPUT_S3_KWARGS
+from .constants import DEFAULT_OUTPUT_S3_NUM_WORKERS
 from .custom import load_custom_func
-from .dataslice import append_slice
+from .dataslice import DataSliceAppender
+from .error import ConverterError
 from .log import LOGGER
 from .log import log_duration
-from .dataslice import find_slice
-from .dataslice import update_slice
 from .version import version
 
 
@@ -67,9 +73,12 @@ class DatasetWriter:
                  output_metadata: Dict[str, Any] = None,
                  output_s3_kwargs: Dict[str, Any] = None,
                  output_retry_kwargs: Dict[str, Any] = None,
+                 output_num_workers: int = None,
+                 process_rechunk_max_mem: str = None,
                  input_decode_cf: bool = False,
                  input_paths: Sequence[str] = None,
                  finalize_only: bool = False,
+                 defer_consolidation: bool = False,
                  dry_run: bool = False):
         if not output_path:
             raise ValueError('output_path must be given')
@@ -93,17 +102,26 @@ class DatasetWriter:
         self._output_s3_kwargs = output_s3_kwargs
         self._output_retry_kwargs =\
             output_retry_kwargs or DEFAULT_OUTPUT_RETRY_KWARGS
+        self._output_num_workers = output_num_workers
+        self._process_rechunk_max_mem = process_rechunk_max_mem
         self._input_decode_cf = input_decode_cf
         self._input_paths = input_paths
         self._finalize_only = finalize_only
+        self._defer_consolidation = defer_consolidation
         self._dry_run = dry_run
-        if output_s3_kwargs or output_path.startswith('s3://'):
-            self._fs = fsspec.filesystem('s3', **(output_s3_kwargs or {}))
+        self._output_is_s3 = bool(output_s3_kwargs) \
+            or output_path.startswith('s3://')
+        if self._output_is_s3:
+            self._fs = fsspec.filesystem('s3',
+                                         **_get_s3_kwargs(output_s3_kwargs))
         else:
             self._fs = fsspec.filesystem('file')
             self._output_path = os.path.expanduser(self._output_path)
         self._output_store = None
         self._output_path_exists = None
+        # True, if consolidated metadata of the output has been
+        # removed and must be recreated after writing or on finalization
+        self._output_consolidation_pending = False
 
     def write_dataset(self,
                       ds: xr.Dataset,
@@ -117,9 +135,39 @@ class DatasetWriter:
             ds = self._output_custom_postprocessor(ds)
         retry.api.retry_call(self._write_dataset,
                              fargs=[ds],
-                             fkwargs=dict(encoding=encoding, append=append),
+                             fkwargs=dict(encoding=encoding,
+                                          append=append),
                              logger=LOGGER,
                              **self._output_retry_kwargs)
+        if self._output_consolidation_pending \
+                and not self._defer_consolidation:
+            zarr.convenience.consolidate_metadata(self._output_store)
+            self._output_consolidation_pending = False
+
+    def _get_compute_kwargs(self) -> Dict[str, Any]:
+        # The scheduler is passed to the computation of the written data
+        # rather than set in Dask's global configuration, which would
+        # also apply to computations done concurrently by other threads.
+        if dask.config.get('scheduler', None):
+            return {}
+        num_workers = self._output_num_workers
+        if not num_workers:
+            if not self._output_is_s3:
+                return {}
+            # Use more threads than CPU cores, so that uploads of
+            # chunks overlap with their compression.
+            num_workers = max(os.cpu_count() or 1,
+                              DEFAULT_OUTPUT_S3_NUM_WORKERS)
+        return dict(scheduler='threads', num_workers=num_workers)
+
+    def _to_zarr(self, ds: xr.Dataset, **kwargs):
+        compute_kwargs = self._get_compute_kwargs()
+        if not compute_kwargs:
+            ds.to_zarr(self._output_store, **kwargs)
+        else:
+            ds.to_zarr(self._output_store,
+                       compute=False,
+                       **kwargs).compute(**compute_kwargs)
 
     def finalize_dataset(self):
         retry.api.retry_call(self._finalize_dataset,
@@ -148,19 +196,83 @@ class DatasetWriter:
             else:
                 if self._output_overwrite and self._output_path_exists:
                     self._remove_dataset()
-            self._output_store = self._fs.get_mapper(self._output_path)
+            # Other than a plain fsspec mapper, zarr's FSStore implements
+            # setitems(), so that multiple chunks written at once are
+            # passed to the (asynchronous) file system in a single batch.
+            self._output_store = zarr.storage.FSStore(self._output_path,
+                                                      fs=self._fs)
 
     def _create_dataset(self, ds, encoding):
         with log_duration(f'Writing dataset'):
             if not self._dry_run:
-                ds.to_zarr(self._output_store,
-                           mode='w' if self._output_overwrite else 'w-',
-                           encoding=encoding,
-                           consolidated=self._output_consolidated)
+                if self._process_rechunk_max_mem:
+                    self._create_dataset_with_rechunker(ds, encoding)
+                else:
+                    self._to_zarr(ds,
+                                  mode='w' if self._output_overwrite else 'w-',
+                                  encoding=encoding,
+                                  consolidated=self._output_consolidated)
             else:
                 LOGGER.warning('Writing disabled, dry run!')
             self._output_path_exists = True
 
+    def _create_dataset_with_rechunker(self, ds, encoding):
+        try:
+            import rechunker
+        except ImportError as e:
+            raise ConverterError('Package "rechunker" is required'
+                                 ' for process/rechunk_max_mem') from e
+        if self._output_path_exists and not self._output_overwrite:
+            # Same as mode='w-' when writing with xarray
+            raise ContainsGroupError(self._output_path)
+        encoding = encoding or {}
+        target_chunks = {}
+        target_options = {}
+        for var_name, var in ds.variables.items():
+            var_encoding = dict(encoding.get(var_name, {}))
+            chunks = var_encoding.pop('chunks', None)
+            if chunks is None:
+                # Keep the Dask chunking, if any, otherwise write
+                # the variable as a single chunk.
+                chunks = tuple(c[0] for c in var.chunks) \
+                    if var.chunks is not None else var.shape
+            target_chunks[var_name] = dict(zip(var.dims, chunks))
+            target_options[var_name] = var_encoding
+        temp_path = self._output_path.rstrip('/') + '.rechunker-temp'
+        # Remove leftovers of a previous run that did not complete.
+        self._remove_rechunker_temp(temp_path)
+        temp_store = zarr.storage.FSStore(temp_path, fs=self._fs)
+        try:
+            # Rechunks via an intermediate store with bounded memory,
+            # rather than building a Dask graph that shuffles all chunks.
+            rechunker.rechunk(ds,
+                              target_chunks,
+                              self._process_rechunk_max_mem,
+                              self._output_store,
+                              target_options=target_options,
+                              temp_store=temp_store) \
+                .execute(**self._get_compute_kwargs())
+        finally:
+            self._remove_rechunker_temp(temp_path)
+        if self._output_consolidated:
+            zarr.convenience.consolidate_metadata(self._output_store)
+
+    def _remove_rechunker_temp(self, temp_path: str):
+        if self._fs.exists(temp_path):
+            LOGGER.info(f'Removing temporary store {temp_path}')
+            self._fs.delete(temp_path, recursive=True)
+
+    def _chunk_like_output(self, ds: xr.Dataset) -> xr.Dataset:
+        # With process/rechunk_max_mem, the processor does not rechunk.
+        # Dask chunks must not overlap output chunks when appending,
+        # so we rechunk Dask arrays to the chunks of the output.
+        group = zarr.open_group(self._output_store, mode='r')
+        ds_rechunked = ds.copy()
+        for var_name, var in ds.variables.items():
+            if var.chunks is not None and var_name in group:
+                ds_rechunked[var_name] = var.chunk(group[var_name].chunks)
+        return ds_rechunked
+
     def _append_dataset(self, ds: xr.Dataset):
         with log_duration('Appending dataset'):
 
@@ -188,30 +300,33 @@ class DatasetWriter:
                 # may reduce precision.
                 #
                 # TODO: remove this hack once issue is fixed in xarray.
-                ds = xr.decode_cf(ds)
-                # For all slices except the first we must remove
-                # encoding attributes e.g. "_FillValue" .
-                ds = self._remove_variable_attrs(ds)
+                if _needs_cf_decoding(ds):
+                    ds = xr.decode_cf(ds)
+                    # For all slices except the first we must remove
+                    # encoding attributes e.g. "_FillValue" .
+                    # xr.decode_cf() returns new variables, so
+                    # their attributes can be replaced in place.
+                    ds = self._remove_variable_attrs(ds, copy=False)
+                else:
+                    ds = self._remove_variable_attrs(ds)
 
             if not self._dry_run:
+                if self._process_rechunk_max_mem:
+                    ds = self._chunk_like_output(ds)
                 mode = self._output_append_mode
                 # From Python 3.10 on, the following would be better implemented
                 # with structural pattern matching (PEPs 634 - 636).
                 if mode in (AppendMode.replace, AppendMode.retain):
                     self._append_with_insertions(ds)
                 elif mode is AppendMode.newer:
-                    output_ds = xr.open_zarr(self._output_store)
+                    output_ds = self._open_output_dataset()
                     # NB: assumes both ds and output_ds increasing in append_dim
                     ds_new_only = ds.where(
                         ds[append_dim] > output_ds[append_dim][-1],
                         drop=True)
-                    ds_new_only.to_zarr(self._output_store,
-                                        append_dim=append_dim,
-                                        consolidated=self._output_consolidated)
+                    self._append_to_output(ds_new_only)
                 elif mode in (AppendMode.all, AppendMode.no_overlap):
-                    ds.to_zarr(self._output_store,
-                               append_dim=append_dim,
-                               consolidated=self._output_consolidated)
+                    self._append_to_output(ds)
                 else:
                     # This should never happen, but best to handle it anyway.
                     raise NotImplementedError(  # pragma: no cover
@@ -220,24 +335,65 @@ class DatasetWriter:
             else:
                 LOGGER.warning('Appending disabled, dry run!')
 
+    def _append_to_output(self, ds: xr.Dataset):
+        self._remove_consolidated_metadata()
+        self._to_zarr(ds,
+                      append_dim=self._output_append_dim,
+                      consolidated=False)
+
+    def _remove_consolidated_metadata(self):
+        # Consolidating metadata rewrites the metadata of all arrays, so
+        # we do it only once after writing, or in _finalize_dataset() if
+        # deferred, rather than per append. Until then, consolidated
+        # metadata is removed, so that readers fall back to the arrays'
+        # metadata rather than seeing outdated shapes, even if writing
+        # fails.
+        # Once pending, there is no need to look for ".zmetadata" again.
+        if self._output_consolidation_pending:
+            return
+        has_consolidated_metadata = '.zmetadata' in self._output_store
+        if has_consolidated_metadata or self._output_consolidated:
+            if has_consolidated_metadata:
+                del self._output_store['.zmetadata']
+            self._output_consolidation_pending = True
+
+    def _open_output_dataset(self, **kwargs) -> xr.Dataset:
+        # Consolidated metadata is missing, if consolidation is pending
+        return xr.open_zarr(self._output_store,
+                            consolidated=False
+                            if self._output_consolidation_pending else None,
+                            **kwargs)
+
     def _append_with_insertions(self, ds):
         append_dim = self._output_append_dim
-        for i in range(ds.dims[append_dim]):
+        self._remove_consolidated_metadata()
+        # The appender keeps the output's arrays and append_dim values
+        # across slices
+        num_workers = self._get_compute_kwargs().get('num_workers')
+        appender = DataSliceAppender(self._output_store,
+                                     dimension=append_dim,
+                                     num_workers=num_workers)
+        append_dim_values = ds[append_dim].values
+        num_slices = ds.dims[append_dim]
+        i = 0
+        while i < num_slices:
             dataslice = ds.isel({append_dim: slice(i, i+1)})
-            insert_index, update_mode = \
-                find_slice(self._output_store, dataslice[append_dim],
-                           dimension=append_dim)
+            insert_index, update_mode = appender.find(dataslice[append_dim])
             if update_mode == "append":
-                append_slice(self._output_store, dataslice,
-                             dimension=append_dim)
+                # Subsequent slices can be appended too, as long as their
+                # values keep increasing, so append them all at once.
+                stop = i + appender.get_append_run_length(
+                    append_dim_values[i:]
+                )
+                appender.append(ds.isel({append_dim: slice(i, stop)}))
+                i = stop
+                continue
             elif update_mode == "insert":
                 # Currently only works for local filesystem stores
-                update_slice(self._output_store, insert_index,
-                             dataslice, update_mode, dimension=append_dim)
+                appender.update(insert_index, dataslice, update_mode)
             elif update_mode == "replace":
                 if self._output_append_mode is AppendMode.replace:
-                    update_slice(self._output_store, insert_index,
-                                 dataslice, update_mode, dimension=append_dim)
+                    appender.update(insert_index, dataslice, update_mode)
                 # If the append mode is not "replace", it must be "retain" --
                 # so we do nothing, which retains the existing slice and
                 # discards the new one.
@@ -247,11 +403,15 @@ class DatasetWriter:
                 # so "create" is a "can't happen".
                 raise NotImplementedError(  # pragma: no cover
                     f"Unhandled update mode {update_mode}!")
+            i += 1
 
     def _check_append_allowed(self, ds: xr.Dataset) -> None:
+        if self._output_append_mode is AppendMode.all:
+            # Nothing to check, so don't pay for opening the output store.
+            return
         output_ds = None
         try:
-            output_ds = xr.open_zarr(self._output_store)
+            output_ds = self._open_output_dataset()
         except (GroupNotFoundError, FileNotFoundError):
             pass
             # Output store doesn't exist, so we'll skip checks on it.
@@ -261,11 +421,10 @@ class DatasetWriter:
             # actually exist.) xarray raises FileNotFoundError since
             # v2022.09.0; older versions raise GroupNotFoundError (see
             # xarray issue 6484).
-        if self._output_append_mode is not AppendMode.all:
-            if not self._is_append_dim_monotonic_increasing(output_ds):
-                raise ValueError(
-                    f"Existing {self._output_append_dim} values must "
-                    f"be increasing.")
+        if not self._is_append_dim_monotonic_increasing(output_ds):
+            raise ValueError(
+                f"Existing {self._output_append_dim} values must "
+                f"be increasing.")
         if output_ds is not None and \
                 self._output_append_mode is AppendMode.no_overlap:
             if output_ds[self._output_append_dim][-1] > \
@@ -288,14 +447,34 @@ class DatasetWriter:
     def _remove_dataset(self):
         with log_duration(f'Removing dataset {self._output_path}'):
             if not self._dry_run:
-                self._fs.delete(self._output_path, recursive=True)
+                if self._output_is_s3:
+                    self._fs.delete(self._output_path, recursive=True)
+                else:
+                    # Renaming is atomic and fast, so we can start
+                    # writing while the old dataset is being deleted.
+                    # The trash directory is unique, because a former
+                    # dataset at the same path may still be deleted.
+                    output_path = os.path.abspath(self._output_path)
+                    trash_path = tempfile.mkdtemp(
+                        dir=os.path.dirname(output_path),
+                        prefix=os.path.basename(output_path) + '.trash.'
+                    )
+                    os.rename(output_path,
+                              os.path.join(trash_path,
+                                           os.path.basename(output_path)))
+                    threading.Thread(target=_remove_trash,
+                                     args=(trash_path,),
+                                     name='nc2zarr-remove-dataset').start()
             else:
                 LOGGER.warning('Removal disabled, dry run!')
             self._output_path_exists = False
 
     @classmethod
-    def _remove_variable_attrs(cls, ds: xr.Dataset) -> xr.Dataset:
-        ds = ds.copy()
+    def _remove_variable_attrs(cls,
+                               ds: xr.Dataset,
+                               copy: bool = True) -> xr.Dataset:
+        if copy:
+            ds = ds.copy()
         for k, v in ds.variables.items():
             v.attrs = dict()
         return ds
@@ -307,7 +486,7 @@ class DatasetWriter:
             if self._output_adjust_metadata:
                 self._ensure_store()
                 # Get new attribute values
-                with xr.open_zarr(self._output_store, decode_cf=True) as dataset:
+                with self._open_output_dataset(decode_cf=True) as dataset:
                     history = self._get_history_metadata(dataset)
                     source = self._get_source_metadata(dataset)
                     time_coverage_start, time_coverage_end = \
@@ -335,10 +514,12 @@ class DatasetWriter:
                                          cache_attrs=False) as group:
                         group.attrs.update(metadata_update)
                 if self._output_consolidated \
+                        or self._output_consolidation_pending \
                         or (metadata_update
                             and '.zmetadata' in (self._output_store or {})):
                     self._ensure_store()
                     zarr.convenience.consolidate_metadata(self._output_store)
+                    self._output_consolidation_pending = False
             else:
                 LOGGER.warning('Updating/consolidating '
                                'of metadata disabled, dry run!')
@@ -357,8 +538,7 @@ class DatasetWriter:
 
     @classmethod
     def _get_history_metadata(cls, dataset: xr.Dataset):
-        now = _np_timestamp_to_str(np.array(datetime.datetime.utcnow(),
-                                            dtype=np.datetime64))
+        now = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
         present = f"{now} - converted by nc2zarr, version {version}"
         history = dataset.attrs.get("history")
         return ((history + '\n') if history else '') + present
@@ -369,10 +549,11 @@ class DatasetWriter:
         if 'time' in dataset:
             time = dataset['time']
             bounds = time.attrs.get('bounds', 'time_bnds')
-            if bounds in dataset \
-                    and dataset[bounds].ndim == 2 \
-                    and dataset[bounds].shape[1] == 2:
-                time_bnds = dataset[bounds]
+            # Only the first and last time values are read
+            time_bnds = dataset[bounds] if bounds in dataset else None
+            if time_bnds is not None \
+                    and time_bnds.ndim == 2 \
+                    and time_bnds.shape[1] == 2:
                 time_coverage_start = _xr_timestamp_to_str(time_bnds[0, 0])
                 time_coverage_end = _xr_timestamp_to_str(time_bnds[-1, 1])
             else:
@@ -381,11 +562,71 @@ class DatasetWriter:
         return time_coverage_start, time_coverage_end
 
 
+def _get_s3_kwargs(output_s3_kwargs: Dict[str, Any] = None) \
+        -> Dict[str, Any]:
+    # Use larger blocks and more pooled connections than the s3fs
+    # defaults. Any user-provided settings take precedence.
+    s3_kwargs = dict(DEFAULT_OUTPUT_S3_KWARGS)
+    s3_kwargs.update(output_s3_kwargs or {})
+    s3_kwargs['config_kwargs'] = dict(
+        DEFAULT_OUTPUT_S3_KWARGS['config_kwargs'],
+        **((output_s3_kwargs or {}).get('config_kwargs') or {})
+    )
+    return s3_kwargs
+
+
+def _remove_trash(trash_path: str):
+    try:
+        shutil.rmtree(trash_path)
+    except OSError as e:
+        LOGGER.warning(f'Failed to remove {trash_path}: {e}')
+
+
+# Variable attributes that make xr.decode_cf() change a variable
+_CF_DECODING_ATTRS = frozenset(['_FillValue',
+                                'missing_value',
+                                'scale_factor',
+                                'add_offset',
+                                '_Unsigned',
+                                '_Encoding',
+                                'calendar',
+                                'coordinates',
+                                'dtype'])
+
+# Units that make xr.decode_cf() decode a variable as timedelta
+_CF_TIMEDELTA_UNITS = frozenset(['days',
+                                 'hours',
+                                 'minutes',
+                                 'seconds',
+                                 'milliseconds',
+                                 'microseconds',
+                                 'nanoseconds'])
+
+
+def _needs_cf_decoding(ds: xr.Dataset) -> bool:
+    """Test whether xr.decode_cf() would change *ds*."""
+    if 'coordinates' in ds.attrs:
+        return True
+    for var in ds.variables.values():
+        attrs = var.attrs
+        if not _CF_DECODING_ATTRS.isdisjoint(attrs):
+            return True
+        units = attrs.get('units')
+        if isinstance(units, str) \
+                and (' since ' in units or units in _CF_TIMEDELTA_UNITS):
+            return True
+        if var.dtype.kind == 'S':
+            # Character arrays may be concatenated into strings
+            return True
+    return False
+
+
 def _xr_timestamp_to_str(time_scalar: xr.DataArray):
     return _np_timestamp_to_str(time_scalar.values.item())
 
 
-def _np_timestamp_to_str(time_scalar: np.ndarray):
-    # noinspection PyTypeChecker
-    return pd.to_datetime(time_scalar, utc=True) \
+def _np_timestamp_to_str(time_scalar: Any):
+    # The Timestamp constructor is much cheaper than
+    # pd.to_datetime() for scalars
+    return pd.Timestamp(time_scalar, tz='UTC') \
         .strftime("%Y-%m-%d %H:%M:%S")
@@ -19,11 +19,13 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import io
 import unittest
 
 import yaml
 
 from nc2zarr.config import load_config
+from nc2zarr.config import load_yaml
 from nc2zarr.error import ConverterError
 from tests.helpers import IOCollector
 
@@ -208,3 +210,16 @@ class ConfigFileTest(unittest.TestCase, IOCollector):
         with self.assertRaises(ConverterError) as cm:
             load_config(config_paths=['bibo.yml'])
         self.assertEqual('Configuration not found: bibo.yml', f'{cm.exception}')
+
+
+class LoadYamlTest(unittest.TestCase):
+
+    def test_load_yaml(self):
+        self.assertEqual({'type': 'slurm', 'env_vars': {'N': 2}},
+                         load_yaml('type: slurm\nenv_vars:\n  N: 2\n'))
+        with io.StringIO('- 1\n- 2\n') as fp:
+            self.assertEqual([1, 2], load_yaml(fp))
+
+    def test_load_yaml_is_safe(self):
+        with self.assertRaises(yaml.YAMLError):
+            load_yaml('!!python/object/apply:os.getcwd []')
@@ -23,6 +23,7 @@ import os.path
 import unittest
 
 import pytest
+import xarray as xr
 
 from nc2zarr.converter import Converter
 from nc2zarr.error import ConverterError
@@ -30,6 +31,12 @@ from tests.helpers import IOCollector
 from tests.helpers import ZarrOutputTestMixin
 
 
+def failing_postprocessor(ds: xr.Dataset) -> xr.Dataset:
+    if ds.time.dt.day.values[0] == 2:
+        raise ValueError('Failed to write day 2')
+    return ds
+
+
 class MainTest(unittest.TestCase, IOCollector, ZarrOutputTestMixin):
     def setUp(self):
         self.reset_paths()
@@ -69,6 +76,35 @@ class MainTest(unittest.TestCase, IOCollector, ZarrOutputTestMixin):
                                                 '2020-12-02T10:00:00',
                                                 '2020-12-03T10:00:00'])
 
+    def test_prefetch_depth(self):
+        self.add_inputs('inputs', day_offset=1, num_days=5)
+        for prefetch_depth in (1, 3):
+            with self.subTest(prefetch_depth=prefetch_depth):
+                self.add_output('out.zarr')
+                Converter(input_paths='inputs/*.nc', input_sort_by="path",
+                          input_prefetch_depth=prefetch_depth).run()
+                self.assertZarrOutputOk('out.zarr',
+                                        expected_vars={'lon', 'lat', 'time', 'r_ui16', 'r_i32', 'r_f32'},
+                                        expected_times=['2020-12-01T10:00:00',
+                                                        '2020-12-02T10:00:00',
+                                                        '2020-12-03T10:00:00',
+                                                        '2020-12-04T10:00:00',
+                                                        '2020-12-05T10:00:00'])
+
+    def test_prefetch_depth_with_failing_write(self):
+        self.add_inputs('inputs', day_offset=1, num_days=4)
+        self.add_output('out.zarr')
+        converter = Converter(
+            input_paths='inputs/*.nc',
+            input_sort_by="path",
+            input_decode_cf=True,
+            input_prefetch_depth=1,
+            output_custom_postprocessor='tests.test_converter:failing_postprocessor'
+        )
+        with self.assertRaises(ValueError) as cm:
+            converter.run()
+        self.assertEqual('Failed to write day 2', f'{cm.exception}')
+
     def test_dry_run_with_higher_verbosity(self):
         self.add_inputs('inputs', day_offset=1, num_days=3)
         self.add_output('out.zarr')
@@ -19,10 +19,12 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import os.path
 import unittest
 
 import pytest
 
+from nc2zarr.dataslice import DataSliceAppender
 from nc2zarr.dataslice import append_slice
 from nc2zarr.dataslice import find_slice
 from nc2zarr.dataslice import update_slice
@@ -45,6 +47,93 @@ class DatasliceTest(unittest.TestCase, IOCollector):
             find_slice("/this/path/does/not/exist", 42, "arbitrary_string")
         )
 
+    def test_find_slice(self):
+        dst_path = "my.zarr"
+        self.add_path(dst_path)
+        ds1, ds2 = new_append_test_datasets(
+            ["2001-01-01", "2001-01-03", "2001-01-05"],
+            ["2001-01-01", "2001-01-02", "2001-01-05", "2001-01-06"]
+        )
+        ds1.to_zarr(dst_path)
+        self.assertEqual(
+            [(0, "replace"), (1, "insert"), (2, "replace"), (-1, "append")],
+            [find_slice(dst_path, ds2.t[i:i + 1], "t")
+             for i in range(ds2.t.size)]
+        )
+
+    def test_appender_keeps_values_across_slices(self):
+        dst_path = "my.zarr"
+        self.add_path(dst_path)
+        ds1, ds2 = new_append_test_datasets(
+            ["2001-01-01", "2001-01-03"],
+            ["2001-01-02", "2001-01-04"]
+        )
+        ds1.to_zarr(dst_path)
+        appender = DataSliceAppender(dst_path, dimension="t")
+        self.assertEqual((1, "insert"), appender.find(ds2.t[0:1]))
+        appender.update(1, ds2.isel(t=slice(0, 1)), "insert")
+        self.assertEqual((1, "replace"), appender.find(ds2.t[0:1]))
+        self.assertEqual((-1, "append"), appender.find(ds2.t[1:2]))
+        appender.append(ds2.isel(t=slice(1, 2)))
+        self.assertEqual((3, "replace"), appender.find(ds2.t[1:2]))
+        ds3 = xr.open_zarr(dst_path, consolidated=False)
+        np.testing.assert_equal(
+            np.array(["2001-01-01", "2001-01-02", "2001-01-03", "2001-01-04"],
+                     dtype="datetime64[ns]"), ds3.t.data)
+        np.testing.assert_equal(np.array([0, 1, 0, 1]),
+                                ds3.v.isel(x=0, y=0))
+
+    def test_update_with_missing_variable_leaves_store_unchanged(self):
+        dst_path = "my.zarr"
+        self.add_path(dst_path)
+        ds1, ds2 = new_append_test_datasets(
+            ["2001-01-01", "2001-01-03"],
+            ["2001-01-02"]
+        )
+        ds1 = ds1.assign(w=ds1.v + 2)
+        ds1.to_zarr(dst_path)
+        appender = DataSliceAppender(dst_path, dimension="t")
+        for mode in ("insert", "replace"):
+            with pytest.raises(KeyError):
+                appender.update(1, ds2, mode)
+        ds3 = xr.open_zarr(dst_path, consolidated=False)
+        np.testing.assert_equal(
+            np.array(["2001-01-01", "2001-01-03"], dtype="datetime64[ns]"),
+            ds3.t.data)
+        self.assertEqual((2, 3, 3), ds3.v.shape)
+        self.assertEqual((2, 3, 3), ds3.w.shape)
+        np.testing.assert_equal(np.zeros((2, 3, 3)), ds3.v.values)
+        np.testing.assert_equal(np.full((2, 3, 3), 2.0), ds3.w.values)
+
+    def test_append_run_length_is_limited_by_chunks(self):
+        dst_path = "my.zarr"
+        self.add_path(dst_path)
+        ds1, ds2 = new_append_test_datasets(
+            ["2001-01-01", "2001-01-02"],
+            ["2001-01-03", "2001-01-04", "2001-01-05", "2001-01-04",
+             "2001-01-06"]
+        )
+        ds1.to_zarr(dst_path, encoding={"v": {"chunks": (2, 3, 3)}})
+        appender = DataSliceAppender(dst_path, dimension="t")
+        self.assertEqual(2, appender.get_append_run_length(ds2.t.values))
+        self.assertEqual(1, appender.get_append_run_length(ds2.t.values[2:]))
+
+    def test_update_slice_without_consolidation(self):
+        dst_path = "my.zarr"
+        self.add_path(dst_path)
+        ds1, ds2 = new_append_test_datasets(
+            ["2001-01-01", "2001-01-03"],
+            ["2001-01-02"]
+        )
+        ds1.to_zarr(dst_path, consolidated=True)
+        update_slice(dst_path, 1, ds2, "insert", dimension="t",
+                     consolidate=False)
+        # Outdated consolidated metadata has been removed
+        self.assertFalse(os.path.exists(os.path.join(dst_path,
+                                                     ".zmetadata")))
+        ds3 = xr.open_zarr(dst_path, consolidated=False)
+        self.assertEqual(3, ds3.t.size)
+
     def test_update_slice_illegal_mode(self):
         with pytest.raises(ValueError, match="illegal mode value"):
             # noinspection PyTypeChecker
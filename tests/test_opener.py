@@ -20,6 +20,8 @@
 # DEALINGS IN THE SOFTWARE.
 
 import os.path
+import threading
+import time
 import unittest
 from typing import Sequence, Union, Type
 
@@ -30,6 +32,11 @@ from nc2zarr.opener import DatasetOpener
 from tests.helpers import IOCollector
 
 
+def my_preprocessor(ds: xr.Dataset) -> xr.Dataset:
+    # Module-level, so that it can be pickled for worker processes
+    return ds.assign_attrs(marker=True)
+
+
 class DatasetOpenerTest(unittest.TestCase):
     io_collector = IOCollector()
 
@@ -42,10 +49,6 @@ class DatasetOpenerTest(unittest.TestCase):
     def tearDownClass(cls):
         cls.io_collector.delete_paths()
 
-    @classmethod
-    def _preprocess_dataset(cls, ds: xr.Dataset) -> xr.Dataset:
-        return ds.assign_attrs(marker=True)
-
     def test_open_datasets_wildcard_does_not_resolve(self):
         opener = DatasetOpener(input_paths='imports/*.nc')
         with self.assertRaises(ConverterError) as cm:
@@ -78,7 +81,7 @@ class DatasetOpenerTest(unittest.TestCase):
             self.assertEqual(1, len(result[i].time))
             self.assertNotIn('marker', result[i].attrs)
 
-        result = list(opener.open_datasets(preprocess=self._preprocess_dataset))
+        result = list(opener.open_datasets(preprocess=my_preprocessor))
         self.assertEqual(3, len(result))
         for i in range(3):
             self.assertIsInstance(result[i], xr.Dataset)
@@ -89,7 +92,7 @@ class DatasetOpenerTest(unittest.TestCase):
     def test_open_datasets_prefetch_chunks(self):
 
         opener = DatasetOpener(input_paths='inputs/*.nc', input_prefetch_chunks=True)
-        result = list(opener.open_datasets(preprocess=self._preprocess_dataset))
+        result = list(opener.open_datasets(preprocess=my_preprocessor))
         self.assertEqual(3, len(result))
         for i in range(3):
             self.assertIsInstance(result[i], xr.Dataset)
@@ -97,6 +100,33 @@ class DatasetOpenerTest(unittest.TestCase):
             var = result[i]['r_f32']
             self.assertEqual(((1,), (9, 9), (9, 9, 9, 9)), var.chunks)
 
+    def test_open_datasets_chunks(self):
+        opener = DatasetOpener(input_paths='inputs/*.nc',
+                               input_chunks={'lon': 12},
+                               input_prefetch_chunks=True)
+        result = list(opener.open_datasets())
+        self.assertEqual(3, len(result))
+        for i in range(3):
+            var = result[i]['r_f32']
+            self.assertEqual(((1,), (9, 9), (12, 12, 12)), var.chunks)
+
+    def test_open_datasets_chunk_cache_size(self):
+        import netCDF4
+        old_chunk_cache = netCDF4.get_chunk_cache()
+        try:
+            opener = DatasetOpener(input_paths='inputs/*.nc',
+                                   input_chunk_cache_size=8 * 1024 * 1024)
+            count = 0
+            for _ in opener.open_datasets():
+                self.assertEqual(8 * 1024 * 1024,
+                                 netCDF4.get_chunk_cache()[0])
+                count += 1
+            self.assertEqual(3, count)
+            # The previous chunk cache is restored when done
+            self.assertEqual(old_chunk_cache, netCDF4.get_chunk_cache())
+        finally:
+            netCDF4.set_chunk_cache(*old_chunk_cache)
+
     def test_open_datasets_mf(self):
         opener = DatasetOpener(input_paths='inputs/*.nc', input_multi_file=True)
 
@@ -107,13 +137,44 @@ class DatasetOpenerTest(unittest.TestCase):
         self.assertEqual(3, len(result[0].time))
         self.assertNotIn('marker', result[0].attrs)
 
-        result = list(opener.open_datasets(preprocess=self._preprocess_dataset))
+        result = list(opener.open_datasets(preprocess=my_preprocessor))
         self.assertEqual(1, len(result))
         self.assertIsInstance(result[0], xr.Dataset)
         self.assertIn('time', result[0])
         self.assertEqual(3, len(result[0].time))
         self.assertIn('marker', result[0].attrs)
 
+    def test_open_datasets_mf_with_concat_dim(self):
+        opener = DatasetOpener(input_paths='inputs/*.nc',
+                               input_multi_file=True,
+                               input_sort_by='path',
+                               input_concat_dim='time')
+
+        result = list(opener.open_datasets())
+        self.assertEqual(1, len(result))
+        self.assertIsInstance(result[0], xr.Dataset)
+        self.assertEqual(3, len(result[0].time))
+        self.assertEqual(('time', 'lat', 'lon'), result[0].r_f32.dims)
+        # Variables without concat_dim are not concatenated
+        self.assertEqual(('lon',), result[0].lon.dims)
+        self.assertEqual(('lat',), result[0].lat.dims)
+
+    def test_open_datasets_mf_parallel(self):
+        try:
+            import dask.multiprocessing
+        except ImportError as e:
+            self.skipTest(f'Dask processes scheduler not available: {e}')
+        opener = DatasetOpener(input_paths='inputs/*.nc',
+                               input_multi_file=True,
+                               input_concat_dim='time',
+                               input_parallel=True)
+
+        result = list(opener.open_datasets(preprocess=my_preprocessor))
+        self.assertEqual(1, len(result))
+        self.assertIsInstance(result[0], xr.Dataset)
+        self.assertEqual(3, len(result[0].time))
+        self.assertIn('marker', result[0].attrs)
+
     def test_open_datasets_mf_prefetch_chunks(self):
         opener = DatasetOpener(input_paths='inputs/*.nc',
                                input_multi_file=True,
@@ -128,6 +189,73 @@ class DatasetOpenerTest(unittest.TestCase):
         self.assertEqual(((1, 1, 1), (9, 9), (9, 9, 9, 9)), var.chunks)
 
 
+class _OpenedDataset:
+    def __init__(self, path: str):
+        self.path = path
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class OpenDatasetsPrefetchTest(unittest.TestCase):
+    input_paths = [f'input-{i}.nc' for i in range(6)]
+
+    def _new_opener(self, depth: int) -> DatasetOpener:
+        opener = DatasetOpener(input_paths=self.input_paths,
+                               input_prefetch_depth=depth)
+        opened = []
+        lock = threading.Lock()
+
+        # noinspection PyUnusedLocal
+        def open_dataset(input_file, chunks, preprocess):
+            # Let earlier inputs take longer, so they would
+            # complete out of order if not yielded in order
+            time.sleep(0.01 * (len(self.input_paths)
+                               - self.input_paths.index(input_file)))
+            ds = _OpenedDataset(input_file)
+            with lock:
+                opened.append(ds)
+            return ds
+
+        opener._open_dataset = open_dataset
+        self.opened = opened
+        return opener
+
+    def test_order(self):
+        for depth in (0, 1, 3):
+            opener = self._new_opener(depth)
+            result = list(opener._open_datasets(self.input_paths, None))
+            self.assertEqual(self.input_paths,
+                             [ds.path for ds in result],
+                             msg=f'depth={depth}')
+
+    def test_unconsumed_datasets_are_closed(self):
+        for depth in (0, 1, 3):
+            opener = self._new_opener(depth)
+            datasets = opener._open_datasets(self.input_paths, None)
+            consumed = [next(datasets), next(datasets)]
+            datasets.close()
+            self.assertEqual(self.input_paths[:2],
+                             [ds.path for ds in consumed],
+                             msg=f'depth={depth}')
+            unconsumed = [ds for ds in self.opened if ds not in consumed]
+            if depth == 0:
+                self.assertEqual([], unconsumed)
+            self.assertLessEqual(len(unconsumed), depth)
+            self.assertTrue(all(ds.closed for ds in unconsumed),
+                            msg=f'depth={depth}')
+            self.assertTrue(all(not ds.closed for ds in consumed),
+                            msg=f'depth={depth}')
+
+    def test_negative_depth(self):
+        with self.assertRaises(ConverterError) as cm:
+            DatasetOpener(input_paths=self.input_paths,
+                          input_prefetch_depth=-1)
+        self.assertEqual('Input prefetch depth must not be negative, got -1.',
+                         f'{cm.exception}')
+
+
 class ResolveInputPathsTest(unittest.TestCase):
     io_collector = IOCollector()
 
@@ -114,6 +114,12 @@ class DatasetPreProcessorTest(unittest.TestCase):
                         time_coverage_end='20200908123000')
         self._test_adds_time_dim(ds)
 
+    def test_adds_time_dim_from_attrs_with_datetime_format(self):
+        ds = new_test_dataset(day=None)
+        ds.attrs.update(time_coverage_start='08.09.2020 10:30',
+                        time_coverage_end='08.09.2020 12:30')
+        self._test_adds_time_dim(ds, input_datetime_format='%d.%m.%Y %H:%M')
+
     def test_illegal_time_coverage(self):
         ds = new_test_dataset(day=None)
         ds.attrs.update(time_coverage_start='yesterday',
@@ -134,9 +140,10 @@ class DatasetPreProcessorTest(unittest.TestCase):
         self._test_raises(ds, 'Missing (coordinate) variable "t" for dimension "t".',
                           input_concat_dim='t')
 
-    def _test_adds_time_dim(self, ds: xr.Dataset):
+    def _test_adds_time_dim(self, ds: xr.Dataset, input_datetime_format: str = None):
         self.assertNotIn('time', ds)
-        pre_processor = DatasetPreProcessor(input_variables=None, input_concat_dim='time')
+        pre_processor = DatasetPreProcessor(input_variables=None, input_concat_dim='time',
+                                            input_datetime_format=input_datetime_format)
         new_ds = pre_processor.preprocess_dataset(ds)
         self.assertIsInstance(new_ds, xr.Dataset)
         self.assertAllInDataset(['r_ui16', 'r_ui16', 'r_i32', 'lon', 'lat', 'time', 'time_bnds'], new_ds)
@@ -54,6 +54,24 @@ class DatasetProcessorTest(unittest.TestCase):
             'time': {'chunks': (1,)},
         }, new_encoding)
 
+    def test_rechunk_already_chunked(self):
+        ds = new_test_dataset(day=1).chunk(dict(lon=8, lat=4, time=1))
+        processor = DatasetProcessor(process_rechunk={'*': dict(lon=8, lat=4, time=1),
+                                                      'r_i32': dict(lon=16)})
+        new_ds, new_encoding = processor.process_dataset(ds)
+        self.assertEqual(ds.r_f32.data.name, new_ds.r_f32.data.name)
+        self.assertNotEqual(ds.r_i32.data.name, new_ds.r_i32.data.name)
+        self.assertEqual(((1,), (4, 4, 4, 4, 2), (16, 16, 4)), new_ds.r_i32.chunks)
+        self.assertEqual({'chunks': (1, 4, 8)}, new_encoding['r_f32'])
+        self.assertEqual({'chunks': (1, 4, 16)}, new_encoding['r_i32'])
+
+    def test_rechunk_without_encoding(self):
+        ds = new_test_dataset(day=1)
+        processor = DatasetProcessor(process_rechunk={'*': dict(lon=8, lat=4, time=1)})
+        new_ds, new_encoding = processor.process_dataset(ds, with_encoding=False)
+        self.assertEqual(((1,), (4, 4, 4, 4, 2), (8, 8, 8, 8, 4)), new_ds.r_f32.chunks)
+        self.assertIsNone(new_encoding)
+
     def test_rechunk_with_lon_lat_time_unchunked(self):
         ds = new_test_dataset(day=1)
         processor = DatasetProcessor(process_rechunk={'*': dict(lon=8, lat=4, time=1),
@@ -19,18 +19,24 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import glob
 import json
 import os.path
+import threading
 import unittest
 import uuid
 
+import dask
 import numpy as np
 import pytest
 import xarray as xr
 import zarr.errors
 
+from nc2zarr.processor import DatasetProcessor
 from nc2zarr.writer import AppendMode
 from nc2zarr.writer import DatasetWriter
+from nc2zarr.writer import _get_s3_kwargs
+from nc2zarr.writer import _needs_cf_decoding
 from tests.helpers import IOCollector
 from tests.helpers import new_append_test_datasets
 from tests.helpers import new_test_dataset
@@ -231,6 +237,70 @@ class DatasetWriterTest(unittest.TestCase, IOCollector):
         writer.write_dataset(ds)
         self.assertTrue(os.path.isdir('my.zarr'))
 
+    def test_local_overwrite_twice(self):
+        self.add_path('my.zarr')
+        for day in (1, 2, 3):
+            writer = DatasetWriter('my.zarr', output_overwrite=True)
+            writer.write_dataset(new_test_dataset(day=day))
+            self.assertTrue(os.path.isdir('my.zarr'))
+        for thread in threading.enumerate():
+            if thread.name == 'nc2zarr-remove-dataset':
+                thread.join()
+        self.assertEqual([], glob.glob('my.zarr.trash.*'))
+
+    def test_local_with_rechunker(self):
+        pytest.importorskip('rechunker')
+        self.add_path('my.zarr')
+        processor = DatasetProcessor(
+            process_rechunk={'*': dict(lon=36, lat=9, time=2)},
+            process_rechunk_max_mem='1MB'
+        )
+        writer = DatasetWriter('my.zarr',
+                               output_append=True,
+                               process_rechunk_max_mem='1MB')
+        for day in (1, 2, 3):
+            ds, encoding = processor.process_dataset(
+                new_test_dataset(day=day, chunked=True)
+            )
+            writer.write_dataset(ds, encoding=encoding)
+        writer.finalize_dataset()
+        self.assertFalse(os.path.exists('my.zarr.rechunker-temp'))
+
+        group = zarr.open_group('my.zarr', mode='r')
+        self.assertEqual((2, 9, 36), group['r_f32'].chunks)
+        self.assertEqual((9,), group['lat'].chunks)
+        self.assertEqual((2,), group['time'].chunks)
+        with xr.open_zarr('my.zarr') as ds:
+            self.assertEqual(3, ds.dims['time'])
+
+    def test_local_with_rechunker_and_existing_output(self):
+        pytest.importorskip('rechunker')
+        self.add_path('my.zarr')
+        self.add_path('my.zarr.rechunker-temp')
+        new_test_dataset(day=1).to_zarr('my.zarr')
+        writer = DatasetWriter('my.zarr', process_rechunk_max_mem='1MB')
+        with self.assertRaises(zarr.errors.ContainsGroupError):
+            writer.write_dataset(new_test_dataset(day=2, chunked=True))
+        self.assertFalse(os.path.exists('my.zarr.rechunker-temp'))
+
+    def test_local_with_rechunker_removes_leftover_temp(self):
+        pytest.importorskip('rechunker')
+        self.add_path('my.zarr')
+        self.add_path('my.zarr.rechunker-temp')
+        os.makedirs('my.zarr.rechunker-temp/r_f32')
+        processor = DatasetProcessor(
+            process_rechunk={'*': dict(lon=36, lat=9, time=1)},
+            process_rechunk_max_mem='1MB'
+        )
+        writer = DatasetWriter('my.zarr', process_rechunk_max_mem='1MB')
+        ds, encoding = processor.process_dataset(
+            new_test_dataset(day=1, chunked=True)
+        )
+        writer.write_dataset(ds, encoding=encoding)
+        self.assertFalse(os.path.exists('my.zarr.rechunker-temp'))
+        group = zarr.open_group('my.zarr', mode='r')
+        self.assertEqual((1, 9, 36), group['r_f32'].chunks)
+
     def test_local_postprocessor(self):
         self.add_path('my.zarr')
         writer = DatasetWriter(
@@ -256,6 +326,67 @@ class DatasetWriterTest(unittest.TestCase, IOCollector):
                               endpoint_url='http://bibo.s3.com'
                           )))
 
+    def test_object_storage_default_params(self):
+        self.assertEqual(
+            {
+                'default_block_size': 32 * 1024 * 1024,
+                'default_cache_type': 'readahead',
+                'config_kwargs': {
+                    'max_pool_connections': 32,
+                    'retries': {'max_attempts': 10, 'mode': 'adaptive'}
+                }
+            },
+            _get_s3_kwargs(None))
+        self.assertEqual(
+            {
+                'anon': True,
+                'default_block_size': 5 * 1024 * 1024,
+                'default_cache_type': 'readahead',
+                'config_kwargs': {
+                    'max_pool_connections': 8,
+                    'retries': {'max_attempts': 10, 'mode': 'adaptive'}
+                }
+            },
+            _get_s3_kwargs(dict(anon=True,
+                                default_block_size=5 * 1024 * 1024,
+                                config_kwargs=dict(max_pool_connections=8))))
+
+    def test_compute_kwargs(self):
+        self.assertEqual({}, DatasetWriter('my.zarr')._get_compute_kwargs())
+        self.assertEqual(
+            dict(scheduler='threads', num_workers=4),
+            DatasetWriter('my.zarr',
+                          output_num_workers=4)._get_compute_kwargs()
+        )
+        compute_kwargs = DatasetWriter('s3://my-bucket/my.zarr',
+                                       output_num_workers=None) \
+            ._get_compute_kwargs()
+        self.assertEqual('threads', compute_kwargs.get('scheduler'))
+        self.assertGreaterEqual(compute_kwargs.get('num_workers'), 16)
+        with dask.config.set(scheduler='synchronous'):
+            self.assertEqual({}, DatasetWriter(
+                'my.zarr', output_num_workers=4
+            )._get_compute_kwargs())
+
+    def test_local_with_num_workers(self):
+        self.add_path('my.zarr')
+        writer = DatasetWriter('my.zarr', output_num_workers=2)
+        writer.write_dataset(new_test_dataset(day=1, chunked=True))
+        # The Dask configuration is not changed globally
+        self.assertIsNone(dask.config.get('scheduler', None))
+        with xr.open_zarr('my.zarr') as ds:
+            self.assertEqual(1, ds.dims['time'])
+
+    def test_needs_cf_decoding(self):
+        ds = xr.Dataset(dict(a=xr.DataArray(np.zeros(3), dims='x',
+                                            attrs=dict(units='K'))))
+        self.assertFalse(_needs_cf_decoding(ds))
+        ds.a.attrs['_FillValue'] = -1.0
+        self.assertTrue(_needs_cf_decoding(ds))
+        ds = xr.Dataset(dict(t=xr.DataArray(np.arange(3), dims='x',
+                                            attrs=dict(units='days since 2020-01-01'))))
+        self.assertTrue(_needs_cf_decoding(ds))
+
     def test_aws_s3_with_unknown_bucket(self):
         ds = new_test_dataset(day=1)
         writer = DatasetWriter(f's3://my{uuid.uuid4()}/my.zarr')
@@ -439,6 +570,55 @@ class DatasetWriterTest(unittest.TestCase, IOCollector):
             ds3.v.isel(x=0, y=0)
         )
 
+    def test_append_runs_and_replace(self):
+        dst_path = "my.zarr"
+        self.add_path(dst_path)
+        ds1, ds2 = new_append_test_datasets(
+            ["2001-01-01", "2001-01-02", "2001-01-03"],
+            ["2001-01-04", "2001-01-05", "2001-01-06", "2001-01-07",
+             "2001-01-03", "2001-01-08"]
+        )
+        ds2["v"] = ds2.v * np.arange(1, 7).reshape((6, 1, 1))
+        # Runs of appended slices are limited to the chunk size
+        ds1.to_zarr(dst_path, encoding={"v": {"chunks": (2, 3, 3)}})
+        w = DatasetWriter(dst_path, output_append=True,
+                          output_append_dim="t",
+                          output_append_mode=AppendMode.replace,
+                          output_consolidated=False)
+        w.write_dataset(ds2)
+        ds3 = xr.open_zarr(dst_path, consolidated=False)
+        np.testing.assert_equal(
+            np.array(["2001-01-01", "2001-01-02", "2001-01-03",
+                      "2001-01-04", "2001-01-05", "2001-01-06",
+                      "2001-01-07", "2001-01-08"],
+                     dtype="datetime64[ns]"), ds3.t.data)
+        np.testing.assert_equal(
+            np.array([0, 0, 5, 1, 2, 3, 4, 6]),
+            ds3.v.isel(x=0, y=0)
+        )
+
+    def test_append_with_deferred_consolidation(self):
+        for mode in (AppendMode.all, AppendMode.replace):
+            with self.subTest(mode=mode):
+                dst_path = "my.zarr"
+                self.add_path(dst_path)
+                ds1, ds2 = new_append_test_datasets(
+                    ["2001-01-01", "2001-01-03"],
+                    ["2001-01-04", "2001-01-05"]
+                )
+                ds1.to_zarr(dst_path, consolidated=True)
+                w = DatasetWriter(dst_path, output_append=True,
+                                  output_append_dim="t",
+                                  output_append_mode=mode,
+                                  output_consolidated=True,
+                                  defer_consolidation=True)
+                w.write_dataset(ds2)
+                # Outdated consolidated metadata has been removed
+                self.assertFalse(os.path.exists(f"{dst_path}/.zmetadata"))
+                w.finalize_dataset()
+                ds3 = xr.open_zarr(dst_path, consolidated=True)
+                self.assertEqual(4, ds3.t.size)
+
     def test_append_overlapping_retain(self):
         for consolidated in False, True:
             with self.subTest(consolidated=consolidated):